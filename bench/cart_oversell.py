@@ -0,0 +1,180 @@
+"""Нагрузочная проверка корзины: параллельные покупатели не продают лишнего.
+
+Несколько процессов с потоками внутри резервируют один товар с небольшим
+остатком (и часть позиций сразу убирают из корзины). После прогона
+проверяется инвариант: остаток не отрицательный, а остаток плюс резервы
+в корзинах равен исходному количеству. Для сравнения тот же прогон
+выполняется старой схемой "прочитать остаток, проверить в Python, записать".
+
+    python bench/cart_oversell.py --workers 4 --threads 8 --ops 100 --stock 500
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prj"))
+
+from sqlalchemy import create_engine, event, text  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from cart import remove_item, reserve_item  # noqa: E402
+from models import db  # noqa: E402
+from sqlite_tuning import apply_pragmas, engine_options  # noqa: E402
+
+PRODUCT_ID = 1
+USERS = 1000
+
+
+def make_engine(path):
+    engine = create_engine("sqlite:///" + path, **engine_options())
+    event.listen(engine, "connect", lambda conn, record: apply_pragmas(conn))
+    return engine
+
+
+def seed(path, stock):
+    engine = create_engine("sqlite:///" + path)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO user (id, username, password_hash, role) VALUES (1, 'owner', '-', 'brand')"))
+        conn.execute(text("INSERT INTO brand (id, name, owner_id) VALUES (1, 'Brand', 1)"))
+        conn.execute(
+            text("INSERT INTO product (id, title, price, is_active, brand_id, quantity_available) "
+                 "VALUES (:id, 'hot', 100, 1, 1, :stock)"),
+            {"id": PRODUCT_ID, "stock": stock},
+        )
+    engine.dispose()
+
+
+def atomic_add(conn, user_id, quantity):
+    return reserve_item(conn, user_id, PRODUCT_ID, quantity) is not None
+
+
+def naive_add(conn, user_id, quantity):
+    # Старая схема: остаток читается, сравнивается в Python и записывается
+    available = conn.execute(
+        text("SELECT quantity_available FROM product WHERE id = :id"), {"id": PRODUCT_ID}
+    ).scalar()
+    if quantity > available:
+        return False
+    time.sleep(0)  # отдать GIL: окно гонки, как между запросами в реальном воркере
+    conn.execute(
+        text("UPDATE product SET quantity_available = :q WHERE id = :id"),
+        {"q": available - quantity, "id": PRODUCT_ID},
+    )
+    conn.execute(
+        text("INSERT INTO cart_item (user_id, product_id, quantity, reserved) VALUES (:u, :p, :q, :q) "
+             "ON CONFLICT (user_id, product_id) DO UPDATE SET "
+             "quantity = quantity + excluded.quantity, reserved = reserved + excluded.reserved"),
+        {"u": user_id, "p": PRODUCT_ID, "q": quantity},
+    )
+    return True
+
+
+def worker(path, atomic, threads, ops, results):
+    engine = make_engine(path)
+    add = atomic_add if atomic else naive_add
+    counters = {"added": 0, "rejected": 0, "removed": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def count(name):
+        with lock:
+            counters[name] += 1
+
+    def run(seed_value):
+        rnd = random.Random(seed_value)
+        for _ in range(ops):
+            user_id = rnd.randint(1, USERS)
+            try:
+                with engine.begin() as conn:
+                    ok = add(conn, user_id, rnd.randint(1, 3))
+                count("added" if ok else "rejected")
+                # Каждая пятая позиция сразу возвращается на склад
+                if ok and rnd.random() < 0.2:
+                    with engine.begin() as conn:
+                        item_id = conn.execute(
+                            text("SELECT id FROM cart_item WHERE user_id = :u AND product_id = :p"),
+                            {"u": user_id, "p": PRODUCT_ID},
+                        ).scalar()
+                    if item_id is not None:
+                        with engine.begin() as conn:
+                            if remove_item(conn, user_id, item_id) is not None:
+                                count("removed")
+            except OperationalError:
+                count("errors")
+
+    pool = [threading.Thread(target=run, args=(os.getpid() * 1000 + i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    engine.dispose()
+    results.put(counters)
+
+
+def check(path, stock):
+    engine = create_engine("sqlite:///" + path)
+    with engine.connect() as conn:
+        available = conn.execute(
+            text("SELECT quantity_available FROM product WHERE id = :id"), {"id": PRODUCT_ID}
+        ).scalar()
+        reserved = conn.execute(
+            text("SELECT COALESCE(SUM(reserved), 0) FROM cart_item WHERE product_id = :id"), {"id": PRODUCT_ID}
+        ).scalar()
+    engine.dispose()
+    return available, reserved, available >= 0 and available + reserved == stock
+
+
+def bench(atomic, workers, threads, ops, stock):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "bench.db")
+    seed(path, stock)
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=worker, args=(path, atomic, threads, ops, results))
+        for _ in range(workers)
+    ]
+    started = time.perf_counter()
+    for p in procs:
+        p.start()
+    totals = {}
+    for _ in procs:
+        for key, value in results.get().items():
+            totals[key] = totals.get(key, 0) + value
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+    return totals, elapsed, check(path, stock)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=100, help="попыток добавления на поток")
+    parser.add_argument("--stock", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{args.workers} процессов x {args.threads} потоков x {args.ops} добавлений, "
+          f"остаток {args.stock}")
+    failed = False
+    for label, atomic in (("чтение+запись", False), ("атомарно", True)):
+        totals, elapsed, (available, reserved, ok) = bench(
+            atomic, args.workers, args.threads, args.ops, args.stock
+        )
+        attempts = totals["added"] + totals["rejected"]
+        print(f"{label:>14}: {attempts / elapsed:8.1f} попыток/с, добавлено {totals['added']}, "
+              f"отказов {totals['rejected']}, удалено {totals['removed']}, "
+              f"ошибок блокировки {totals['errors']}; остаток {available} + в корзинах {reserved} "
+              f"{'=' if available + reserved == args.stock else '!='} {args.stock} "
+              f"{'OK' if ok else 'ПЕРЕПРОДАЖА'}")
+        failed = failed or (atomic and not ok)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+"""Нагрузочный прогон горячих маршрутов всех приложений.
+
+Для каждого приложения создаётся копия его папки во временном каталоге
+(рабочие базы и загрузки репозитория не трогаются), база наполняется
+данными нужного объёма, затем маршруты гоняются двумя способами:
+
+    client — через app.test_client() (стоимость самого приложения);
+    wsgi   — через настоящий WSGI-сервер (werkzeug, threaded) по HTTP.
+
+В обоих режимах запросы шлют --concurrency потоков. Для каждого маршрута
+печатаются число запросов, ошибки, запросов в секунду, p50 и p99.
+
+Объём данных при --scale 1: prj — 100 000 товаров у 1 000 брендов,
+flask4 — 50 000 постов, flask2 — 50 000 записей о загрузках,
+flask3 — 100 000 пользователей, flask1 — 1 000 000 номеров.
+
+    python bench/routes.py --scale 0.1 --requests 500 --concurrency 8
+    python bench/routes.py --apps prj,flask4 --modes wsgi --json before.json
+    python bench/routes.py --apps prj,flask4 --modes wsgi --compare before.json
+
+POST-маршруты меряются вместе с переходом по редиректу, как в браузере:
+иначе flash-сообщения копились бы в cookie сессии. Лимиты попыток входа
+на время прогона сняты (мерим хеширование, а не ответы 429); метод хеша
+паролей — как в рабочем режиме (PASSWORD_HASH_METHOD), поэтому для входа
+число запросов отдельно ограничено --login-requests.
+"""
+import argparse
+import importlib.util
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+from http.cookiejar import CookieJar
+from urllib.parse import urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from common.auth import DEFAULT_METHOD, LoginGuard  # noqa: E402
+
+APPS = ("flask1", "flask2", "flask3", "flask4", "prj")
+PASSWORD = "bench-password"
+WORDS = (
+    "кофе чай шоколад печенье сыр хлеб масло мёд варенье орехи рис гречка "
+    "крем мыло шампунь зубная паста полотенце чашка тарелка лампа стол стул "
+    "красный синий зелёный большой малый новый классический домашний"
+).split()
+
+# target(rng) -> (путь, данные формы или None); login — форма входа для сессии
+Route = namedtuple("Route", "name method target login follow limit", defaults=(None, False, None))
+# close() вызывается, пока текущая папка — ещё копия приложения
+Prepared = namedtuple("Prepared", "app routes close", defaults=(None,))
+
+
+def load_app(name, workdir):
+    """Копирует папку приложения в workdir и импортирует её app.py.
+
+    Приложения открывают файлы относительно текущей папки, поэтому на время
+    прогона она меняется на копию.
+    """
+    target = os.path.join(workdir, name)
+    shutil.copytree(
+        os.path.join(ROOT, name),
+        target,
+        ignore=shutil.ignore_patterns(
+            "__pycache__", "*.db", "*.db-wal", "*.db-shm", "uploads", "instance",
+            "users.json", "files_data.json",
+        ),
+    )
+    os.chdir(target)
+    sys.path.insert(0, target)
+    spec = importlib.util.spec_from_file_location(f"bench_{name}", os.path.join(target, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.create_app({"WTF_CSRF_ENABLED": False})
+    if hasattr(module, "auth"):
+        module.auth = LoginGuard(ip_limit=(10 ** 9, 1), username_limit=(10 ** 9, 1))
+    return module
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def prepare_flask1(workdir, sizes, rng):
+    module = load_app("flask1", workdir)
+    book = module.PHONE_BOOK
+    pages = max(1, len(book) // module.PER_PAGE)
+    book.numbers  # генерация — часть подготовки, а не первого запроса
+    return Prepared(module.app, [
+        Route("index", "GET", lambda r: (f"/?page={r.randint(1, pages)}", None)),
+        Route("number prefix", "GET", lambda r: (f"/number/?number=89{r.randint(0, 9999):04d}", None)),
+    ])
+
+
+def prepare_flask2(workdir, sizes, rng):
+    module = load_app("flask2", workdir)
+    count = sizes["files"]
+    started = datetime(2025, 1, 1)
+    extensions = sorted(module.ALLOWED_EXTENSIONS)
+    rows = []
+    for i in range(count):
+        ext = rng.choice(extensions)
+        digest = "%064x" % rng.getrandbits(256)
+        rows.append((
+            f"{uuid.UUID(int=rng.getrandbits(128))}{ext}", f"file{i}{ext}", ext,
+            (started + timedelta(seconds=i * 600)).strftime("%Y-%m-%d %H:%M:%S"),
+            f"uploads/{digest[:2]}/{digest[2:4]}/{digest}{ext}", digest, None, rng.randint(1000, 10 ** 6),
+        ))
+    module.file_store().count()  # создаёт схему
+    connection = sqlite3.connect(module.app.config["FILE_STORE_PATH"])
+    with connection:
+        connection.executemany(
+            "INSERT INTO file (uuid, original_name, extension, date, path, sha256, md5, size) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    connection.close()
+    upload_size = sizes["upload_bytes"]
+
+    def upload(r):
+        return "/", {"file": (f"bench{r.getrandbits(64)}.txt", r.randbytes(upload_size))}
+
+    return Prepared(module.app, [
+        Route("list", "GET", lambda r: ("/", None)),
+        Route("list page", "GET", lambda r: (f"/?after={r.randint(1, count)}&extension=.png", None)),
+        Route("upload", "POST", upload, follow=True),
+    ], close=module.task_queue().shutdown)
+
+
+def prepare_flask3(workdir, sizes, rng):
+    module = load_app("flask3", workdir)
+    count = sizes["users"]
+    password_hash = generate_password_hash(PASSWORD, DEFAULT_METHOD)
+    now = datetime.now().isoformat()
+    module.store.count()
+    connection = sqlite3.connect(module.DB_FILE)
+    with connection:
+        connection.executemany(
+            "INSERT INTO user (username, password, registered_at) VALUES (?, ?, ?)",
+            ((f"user{i}", password_hash, now) for i in range(count)),
+        )
+    connection.close()
+
+    def login(r):
+        return "/", {"username": f"user{r.randrange(count)}", "password": PASSWORD}
+
+    return Prepared(module.app, [
+        Route("login", "POST", login, follow=True, limit="login"),
+        Route("users page", "GET", lambda r: (f"/register?after={r.randint(1, count)}", None)),
+    ], close=module.store.flush)
+
+
+def prepare_flask4(workdir, sizes, rng):
+    module = load_app("flask4", workdir)
+    count = sizes["posts"]
+    started = datetime(2024, 1, 1)
+    # Схему создаёт create_app() в load_app
+    with module.app.app_context():
+        module.db.session.add(module.User(username="admin", password=generate_password_hash(PASSWORD)))
+        module.db.session.execute(
+            module.db.insert(module.Post),
+            [
+                {
+                    "title": sentence(rng, 4),
+                    "content": sentence(rng, rng.randint(50, 400)),
+                    "is_private": rng.random() < 0.2,
+                    "created_at": started + timedelta(minutes=i * 10),
+                    "author_id": 1,
+                }
+                for i in range(count)
+            ],
+        )
+        module.db.session.commit()
+        public = module.db.session.scalars(
+            module.db.select(module.Post.id).filter_by(is_private=False)
+        ).all()
+
+    return Prepared(module.app, [
+        Route("index", "GET", lambda r: ("/", None)),
+        Route("index page", "GET", lambda r: (f"/?before={r.choice(public)}", None)),
+        Route("post", "GET", lambda r: (f"/post/{r.choice(public)}", None)),
+    ])
+
+
+def prepare_prj(workdir, sizes, rng):
+    module = load_app("prj", workdir)
+    from search import rebuild_index
+
+    db, products, brands = module.db, sizes["products"], sizes["brands"]
+    password_hash = generate_password_hash(PASSWORD, DEFAULT_METHOD)
+    buyers = 16
+    # Схему и миграции выполняет create_app() в load_app
+    with module.app.app_context():
+        db.session.add(module.User(username="owner", password_hash=password_hash, role="brand"))
+        db.session.add_all(
+            module.User(username=f"buyer{i}", password_hash=password_hash, role="buyer")
+            for i in range(buyers)
+        )
+        db.session.flush()
+        db.session.execute(
+            db.insert(module.Brand),
+            [{"name": f"Бренд {i}", "description": sentence(rng, 12), "owner_id": 1} for i in range(brands)],
+        )
+        db.session.execute(
+            db.insert(module.Product),
+            [
+                {
+                    "title": f"{sentence(rng, 2).capitalize()} {i}",
+                    "description": sentence(rng, 30),
+                    "price": Decimal(rng.randint(100, 500000)) / 100,
+                    "brand_id": rng.randint(1, brands),
+                    "quantity_available": 10 ** 6,
+                    "is_active": True,
+                }
+                for i in range(products)
+            ],
+        )
+        db.session.commit()
+        with db.engine.begin() as connection:
+            rebuild_index(connection)
+
+    def login(n):
+        return "/login", {"username": f"buyer{n % buyers}", "password": PASSWORD}
+
+    def sign_in(r):
+        return "/login", {"username": f"buyer{r.randrange(buyers)}", "password": PASSWORD}
+
+    return Prepared(module.app, [
+        Route("index", "GET", lambda r: ("/", None)),
+        Route("search", "GET", lambda r: ("/?" + urlencode({"search": r.choice(WORDS)}), None)),
+        Route("api products", "GET", lambda r: (f"/api/products?brand={r.randint(1, brands)}", None)),
+        Route("add_to_cart", "POST", lambda r: (f"/cart/add/{r.randint(1, products)}", {"quantity": 1}),
+              login=login, follow=True),
+        Route("cart", "GET", lambda r: ("/cart", None), login=login),
+        Route("login", "POST", sign_in, follow=True, limit="login"),
+    ])
+
+
+class ClientSession:
+    def __init__(self, app, base_url=None):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, follow=False):
+        if data:
+            data = {
+                key: (io.BytesIO(value[1]), value[0]) if isinstance(value, tuple) else value
+                for key, value in data.items()
+            }
+        response = self.client.open(path, method=method, data=data, follow_redirects=follow)
+        response.close()
+        return response.status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _multipart(data):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for key, value in data.items():
+        body.write(f"--{boundary}\r\n".encode())
+        if isinstance(value, tuple):
+            filename, content = value
+            body.write(
+                f'Content-Disposition: form-data; name="{key}"; filename="{filename}"\r\n'
+                "Content-Type: application/octet-stream\r\n\r\n".encode()
+            )
+            body.write(content)
+        else:
+            body.write(f'Content-Disposition: form-data; name="{key}"\r\n\r\n{value}'.encode())
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+class HTTPSession:
+    def __init__(self, app, base_url):
+        self.base_url = base_url
+        cookies = urllib.request.HTTPCookieProcessor(CookieJar())
+        self.openers = {
+            False: urllib.request.build_opener(cookies, _NoRedirect),
+            True: urllib.request.build_opener(cookies),
+        }
+
+    def request(self, method, path, data=None, follow=False):
+        headers = {}
+        body = None
+        if data is not None:
+            if any(isinstance(value, tuple) for value in data.values()):
+                body, headers["Content-Type"] = _multipart(data)
+            else:
+                body = urlencode(data).encode()
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.openers[follow].open(request, timeout=120) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def run_route(session_factory, route, requests, concurrency, seed):
+    """Гоняет маршрут requests раз из concurrency потоков; возвращает сводку."""
+    counter = itertools.count()
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    # Отсчёт начинается в момент, когда все потоки готовы (action барьера):
+    # основной поток после барьера может проснуться позже рабочих
+    started = []
+    ready = threading.Barrier(concurrency + 1, action=lambda: started.append(time.perf_counter()))
+
+    def worker(n):
+        rng = random.Random(seed * 1000 + n)
+        session = session_factory()
+        try:
+            if route.login:
+                session.request("POST", *route.login(n))
+            # Первый запрос без замера: прогрев соединений и кэшей шаблонов
+            session.request(route.method, *route.target(rng), follow=route.follow)
+        except BaseException:
+            ready.abort()
+            raise
+        local, codes = [], {}
+        ready.wait()
+        while next(counter) < requests:
+            path, data = route.target(rng)
+            started = time.perf_counter()
+            status = session.request(route.method, path, data, follow=route.follow)
+            local.append(time.perf_counter() - started)
+            codes[status] = codes.get(status, 0) + 1
+        with lock:
+            latencies.extend(local)
+            for status, count in codes.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started[0]
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+    }
+
+
+def serve(app):
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_row(key, result, baseline):
+    line = (f"{key:<40}{result['requests']:>8}{result['errors']:>8}"
+            f"{result['rps']:>10.1f}{result['p50']:>10.2f}{result['p99']:>10.2f}")
+    if baseline and key in baseline:
+        before = baseline[key]
+        line += (f"{(result['rps'] / before['rps'] - 1) * 100:>+9.1f}%"
+                 f"{(result['p50'] / before['p50'] - 1) * 100:>+9.1f}%"
+                 f"{(result['p99'] / before['p99'] - 1) * 100:>+9.1f}%")
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", default=",".join(APPS))
+    parser.add_argument("--modes", default="client,wsgi")
+    parser.add_argument("--scale", type=float, default=0.01, help="доля от полного объёма данных")
+    parser.add_argument("--requests", type=int, default=300, help="запросов на маршрут")
+    parser.add_argument("--login-requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--upload-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    parser.add_argument("--compare", help="сравнить с результатами из файла (--json прошлого прогона)")
+    args = parser.parse_args()
+
+    sizes = {
+        "products": max(100, int(100_000 * args.scale)),
+        "brands": max(10, int(1_000 * args.scale)),
+        "posts": max(100, int(50_000 * args.scale)),
+        "files": max(100, int(50_000 * args.scale)),
+        "users": max(100, int(100_000 * args.scale)),
+        "numbers": max(1000, int(1_000_000 * args.scale)),
+        "upload_bytes": args.upload_bytes,
+    }
+    os.environ["PHONE_COUNT"] = str(sizes["numbers"])
+    os.environ["PHONE_SEED"] = str(args.seed)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    workdir = tempfile.mkdtemp(prefix="bench-routes-")
+    cwd = os.getcwd()
+    results = {}
+    print(f"данные: {sizes}")
+    header = f"{'маршрут':<40}{'запросы':>8}{'ошибки':>8}{'rps':>10}{'p50, мс':>10}{'p99, мс':>10}"
+    if baseline:
+        header += f"{'Δrps':>10}{'Δp50':>10}{'Δp99':>10}"
+    print(header)
+    try:
+        for name in args.apps.split(","):
+            rng = random.Random(args.seed)
+            started = time.perf_counter()
+            prepared = globals()[f"prepare_{name}"](workdir, sizes, rng)
+            print(f"{name}: данные готовы за {time.perf_counter() - started:.1f} с", flush=True)
+            for mode in args.modes.split(","):
+                server = None
+                if mode == "wsgi":
+                    server, base_url = serve(prepared.app)
+                    session_factory = lambda: HTTPSession(prepared.app, base_url)  # noqa: E731
+                else:
+                    session_factory = lambda: ClientSession(prepared.app)  # noqa: E731
+                try:
+                    for route in prepared.routes:
+                        requests = args.login_requests if route.limit == "login" else args.requests
+                        result = run_route(session_factory, route, requests, args.concurrency, args.seed)
+                        key = f"{name} {route.name} [{mode}]"
+                        results[key] = result
+                        print_row(key, result, baseline)
+                finally:
+                    if server is not None:
+                        server.shutdown()
+            if prepared.close:
+                prepared.close()
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {"revision": git_revision(), "sizes": sizes, "concurrency": args.concurrency,
+                 "results": results},
+                f, ensure_ascii=False, indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Конкурентные записи в SQLite: настройки по умолчанию против sqlite_tuning.
+
+Имитирует несколько воркеров gunicorn (процессы) с потоками внутри, которые
+добавляют товары в корзину, и печатает пропускную способность и число
+ошибок "database is locked" для обеих конфигураций.
+
+    python bench/sqlite_writers.py --workers 4 --threads 4 --ops 200
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prj"))
+
+from sqlalchemy import create_engine, event, text  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from models import db  # noqa: E402
+from sqlite_tuning import apply_pragmas, engine_options  # noqa: E402
+
+PRODUCTS = 200
+USERS = 500
+
+
+def make_engine(path, tuned):
+    url = "sqlite:///" + path
+    if not tuned:
+        return create_engine(url)
+    engine = create_engine(url, **engine_options())
+    event.listen(engine, "connect", lambda conn, record: apply_pragmas(conn))
+    return engine
+
+
+def seed(path):
+    engine = create_engine("sqlite:///" + path)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO user (id, username, password_hash, role) VALUES (1, 'owner', '-', 'brand')"))
+        conn.execute(text("INSERT INTO brand (id, name, owner_id) VALUES (1, 'Brand', 1)"))
+        conn.execute(
+            text("INSERT INTO product (id, title, price, is_active, brand_id, quantity_available) "
+                 "VALUES (:id, :title, 100, 1, 1, 1000000)"),
+            [{"id": i, "title": f"p{i}"} for i in range(1, PRODUCTS + 1)],
+        )
+    engine.dispose()
+
+
+def add_to_cart(conn, user_id, product_id):
+    # Та же последовательность, что и в add_to_cart: чтение остатка, поиск позиции, запись
+    conn.execute(text("SELECT quantity_available FROM product WHERE id = :id"), {"id": product_id}).scalar()
+    row = conn.execute(
+        text("SELECT id, quantity FROM cart_item WHERE user_id = :u AND product_id = :p"),
+        {"u": user_id, "p": product_id},
+    ).first()
+    if row:
+        conn.execute(text("UPDATE cart_item SET quantity = :q WHERE id = :id"), {"q": row.quantity + 1, "id": row.id})
+    else:
+        conn.execute(
+            text("INSERT INTO cart_item (user_id, product_id, quantity) VALUES (:u, :p, 1)"),
+            {"u": user_id, "p": product_id},
+        )
+
+
+def worker(path, tuned, threads, ops, results):
+    engine = make_engine(path, tuned)
+    done, errors = [0], [0]
+    lock = threading.Lock()
+
+    def run(seed_value):
+        rnd = random.Random(seed_value)
+        for _ in range(ops):
+            try:
+                with engine.begin() as conn:
+                    add_to_cart(conn, rnd.randint(1, USERS), rnd.randint(1, PRODUCTS))
+                with lock:
+                    done[0] += 1
+            except OperationalError:
+                with lock:
+                    errors[0] += 1
+
+    pool = [threading.Thread(target=run, args=(os.getpid() * 1000 + i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    engine.dispose()
+    results.put((done[0], errors[0]))
+
+
+def bench(tuned, workers, threads, ops):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "bench.db")
+    seed(path)
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=worker, args=(path, tuned, threads, ops, results))
+        for _ in range(workers)
+    ]
+    started = time.perf_counter()
+    for p in procs:
+        p.start()
+    totals = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+    done = sum(t[0] for t in totals)
+    errors = sum(t[1] for t in totals)
+    return done, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=200, help="транзакций на поток")
+    args = parser.parse_args()
+
+    print(f"{args.workers} процессов x {args.threads} потоков x {args.ops} транзакций")
+    for label, tuned in (("по умолчанию", False), ("sqlite_tuning", True)):
+        done, errors, elapsed = bench(tuned, args.workers, args.threads, args.ops)
+        print(f"{label:>14}: {done / elapsed:8.1f} транз/с, успешно {done}, "
+              f"ошибок блокировки {errors}, {elapsed:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
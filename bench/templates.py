@@ -0,0 +1,110 @@
+"""Стоимость рендера встроенных шаблонов flask1–flask4.
+
+Сравнивает на одном и том же контексте:
+    string   — render_template_string(исходник), как было раньше;
+    compiled — render_template(имя) после init_templates (шаблон уже в кэше);
+и время старта (получить все шаблоны в новом окружении):
+    source   — компиляция из исходников;
+    modules  — загрузка заранее скомпилированных модулей (compile-templates).
+
+    python bench/templates.py --repeat 2000
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from flask import render_template, render_template_string  # noqa: E402
+from jinja2 import DictLoader, ModuleLoader  # noqa: E402
+
+
+def load_app(name):
+    """Импортирует <name>/app.py под именем bench_<name> (в отдельной папке: приложения пишут в cwd)."""
+    app_dir = os.path.join(ROOT, name)
+    sys.path.insert(0, app_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(f"bench_{name}", os.path.join(app_dir, "app.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.create_app()
+    finally:
+        sys.path.remove(app_dir)
+    return module
+
+
+def cases():
+    """(приложение, имя шаблона, исходник, функция контекста)."""
+    flask1, flask2, flask3, flask4 = (load_app(name) for name in ("flask1", "flask2", "flask3", "flask4"))
+    flask3.app.config["WTF_CSRF_ENABLED"] = False
+    files = [
+        {"uuid": f"{i}.png", "original_name": f"photo{i}.png", "extension": ".png",
+         "date": "2026-01-01 00:00:00", "path": f"uploads/{i}.png"}
+        for i in range(50)
+    ]
+    return [
+        (flask1.app, "index.html", flask1.INDEX_TEMPLATE,
+         lambda m=flask1: {"numbers": m.PHONE_BOOK.page(1), "page": 1, "pages": 10}),
+        (flask1.app, "number.html", flask1.NUMBER_TEMPLATE, lambda: {"number": "89001234567"}),
+        (flask2.app, "file_list.html", flask2.FILE_LIST_TEMPLATE,
+         lambda: {"files": files, "next_cursor": 50, "filters": {}}),
+        (flask3.app, "login.html", flask3.TEMPLATE_LOGIN, lambda m=flask3: {"form": m.LoginForm()}),
+        (flask4.app, "login.html", flask4.TEMPLATE_LOGIN, lambda: {}),
+        (flask4.app, "post.html", flask4.TEMPLATE_POST, lambda: {}),
+    ]
+
+
+def per_call(f, repeat):
+    f()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        f()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def startup(app, templates, module_dir, repeat):
+    def from_source():
+        env = app.jinja_env.overlay(loader=DictLoader(templates), cache_size=0)
+        for name in templates:
+            env.get_template(name)
+
+    def from_modules():
+        env = app.jinja_env.overlay(loader=ModuleLoader(module_dir), cache_size=0)
+        for name in templates:
+            env.get_template(name)
+
+    return per_call(from_source, repeat), per_call(from_modules, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    print(f"{'шаблон':<24}{'string, мкс':>14}{'compiled, мкс':>16}{'ускорение':>12}")
+    all_cases = cases()
+    for app, name, source, context in all_cases:
+        with app.test_request_context():
+            values = context()
+            before = per_call(lambda: render_template_string(source, **values), args.repeat)
+            after = per_call(lambda: render_template(name, **values), args.repeat)
+        label = f"{app.import_name.replace('bench_', '')}/{name}"
+        print(f"{label:<24}{before:>14.1f}{after:>16.1f}{before / after:>11.1f}x")
+
+    print()
+    print(f"{'старт приложения':<24}{'source, мкс':>14}{'modules, мкс':>16}")
+    for app in {id(case[0]): case[0] for case in all_cases}.values():
+        templates = app.jinja_loader.mapping
+        module_dir = tempfile.mkdtemp()
+        app.jinja_env.overlay(loader=DictLoader(templates)).compile_templates(module_dir, zip=None)
+        source, modules = startup(app, templates, module_dir, max(1, args.repeat // 20))
+        print(f"{app.import_name.replace('bench_', ''):<24}{source:>14.1f}{modules:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Проверка паролей при входе: лимиты попыток, ограниченный пул хеширования.
+
+Один вход стоит полного pbkdf2 (сотни тысяч итераций), поэтому перебор
+паролей легко занимает все ядра. LoginGuard:
+
+* ограничивает попытки корзиной токенов отдельно по IP и по логину;
+* для несуществующего пользователя проверяет пароль против заглушки
+  того же метода — ответ стоит столько же, и наличие логина не видно
+  по времени;
+* считает хеши в пуле из нескольких потоков с ограниченной очередью:
+  лишние попытки сразу получают отказ, а не копятся и не отнимают
+  процессор у остальных запросов;
+* после успешного входа сообщает новый хеш, если хеш пользователя
+  посчитан другим методом или числом итераций (PASSWORD_HASH_METHOD).
+
+Лимиты хранятся в памяти процесса, у каждого воркера — свои.
+
+    auth = LoginGuard()
+
+    try:
+        result = auth.login(username, password, stored_hash, request.remote_addr)
+    except TooManyAttempts:
+        ...  # 429
+    if result.ok and result.new_hash:
+        ...  # сохранить result.new_hash
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from common.metrics import timed
+
+DEFAULT_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+
+LoginResult = namedtuple("LoginResult", "ok new_hash")
+
+
+class TooManyAttempts(Exception):
+    """Превышен лимит попыток входа или пул проверки паролей перегружен."""
+
+
+class RateLimiter:
+    """Корзина токенов на ключ: capacity попыток подряд, затем rate в секунду."""
+
+    def __init__(self, capacity, per_seconds, max_keys=100000):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # ключ -> (токены, время)
+        self._lock = threading.Lock()
+
+    def allow(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            # Самые давние корзины вытесняются: они уже успели наполниться
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, workers=2, max_pending=32, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._reset()
+        # Заглушка для несуществующих пользователей: проверка против неё
+        # стоит столько же, сколько настоящая (хеш никогда не совпадёт)
+        self._dummy_hash = f"{method}$dummy${'0' * 64}"
+        self._prefix = None
+        if hasattr(os, "register_at_fork"):
+            # Потоки пула не переживают fork (gunicorn --preload): в дочернем
+            # процессе пул создаётся заново при первом хешировании
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _submit(self, f, *args):
+        if not self._slots.acquire(blocking=False):
+            raise TooManyAttempts("Очередь проверки паролей переполнена")
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="auth")
+        try:
+            future = self._executor.submit(f, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            with timed("hash"):
+                return future.result(self.timeout)
+        except TimeoutError:
+            raise TooManyAttempts("Проверка пароля не дождалась очереди")
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        """Проверяет пароль; для stored_hash=None тратит то же время и возвращает False."""
+        if not stored_hash:
+            self._submit(check_password_hash, self._dummy_hash, password)
+            return False
+        return self._submit(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        # Префикс "метод:параметры" в том виде, в каком его пишет werkzeug
+        # (например, "pbkdf2:sha256" дополняется числом итераций)
+        if self._prefix is None:
+            self._prefix = generate_password_hash("", self.method).split("$", 1)[0]
+        return stored_hash.split("$", 1)[0] != self._prefix
+
+
+class LoginGuard:
+    def __init__(self, hasher=None, ip_limit=(20, 60), username_limit=(5, 60)):
+        self.hasher = hasher or PasswordHasher()
+        self.ip_limiter = RateLimiter(*ip_limit)
+        self.username_limiter = RateLimiter(*username_limit)
+
+    def hash(self, password):
+        return self.hasher.hash(password)
+
+    def login(self, username, password, stored_hash, remote_addr=None):
+        """Проверка пароля при входе.
+
+        stored_hash=None — пользователя нет. Возвращает LoginResult(ok, new_hash);
+        new_hash не None, если хеш нужно пересчитать и сохранить.
+        """
+        if not self.ip_limiter.allow(remote_addr) or not self.username_limiter.allow(username):
+            raise TooManyAttempts("Слишком много попыток входа")
+
+        if not self.hasher.verify(stored_hash, password):
+            return LoginResult(False, None)
+
+        self.username_limiter.reset(username)
+        new_hash = self.hasher.hash(password) if self.hasher.needs_rehash(stored_hash) else None
+        return LoginResult(True, new_hash)
@@ -0,0 +1,73 @@
+"""Условные GET-запросы (ETag / Last-Modified) по отметкам изменений.
+
+Страница зависит от отметок областей (время или версия последнего
+изменения). ETag строится из адреса и отметок, Last-Modified — время
+последнего изменения. Если клиент прислал совпадающий If-None-Match или
+If-Modified-Since, отдаётся 304 без запросов страницы к базе и без рендера.
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from werkzeug.http import is_resource_modified
+
+
+def make_etag(*parts):
+    return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:32]
+
+
+def from_timestamp(microseconds):
+    """Отметка в микросекундах -> datetime для Last-Modified."""
+    return datetime.fromtimestamp(microseconds / 1e6, timezone.utc)
+
+
+def can_validate():
+    # Сообщения flash живут в сессии и выводятся один раз: страница с ними
+    # не должна приходить из кэша браузера
+    return request.method in ("GET", "HEAD") and "_flashes" not in session
+
+
+def not_modified(etag, last_modified):
+    """Ответ 304, если у клиента актуальная версия, иначе None."""
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    response = current_app.response_class(status=304)
+    set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # Браузер хранит страницу, но перед показом сверяется с сервером;
+    # анонимная и авторизованная версии отличаются только cookie
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Cookie")
+    return response
+
+
+def conditional(validators):
+    """Декоратор условного GET.
+
+    validators(**view_args) возвращает (etag, last_modified) или None, если
+    страницу проверять не нужно (например, для авторизованного пользователя).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            found = validators(**kwargs) if can_validate() else None
+            if found is None:
+                return f(*args, **kwargs)
+            etag, last_modified = found
+            response = not_modified(etag, last_modified)
+            if response is not None:
+                return response
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                set_validators(response, etag, last_modified)
+            return response
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,101 @@
+"""Отдача загруженных файлов с кэшированием на стороне клиента.
+
+Имена загрузок уникальны (uuid или хеш содержимого), поэтому содержимое по
+одному URL никогда не меняется: отдаём сильный ETag по хешу содержимого и
+Cache-Control immutable. Условные запросы (If-None-Match) и Range
+обрабатывает werkzeug. Передачу байтов можно переложить на веб-сервер:
+
+    FILE_OFFLOAD = "x-accel"     # nginx: X-Accel-Redirect на FILE_OFFLOAD_PREFIX
+    FILE_OFFLOAD = "x-sendfile"  # Apache/lighttpd: заголовок X-Sendfile
+"""
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+from flask import abort, current_app, request, send_file
+from werkzeug.utils import safe_join
+
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_CACHE_SIZE = 4096
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# path -> (mtime_ns, size, sha256), чтобы не перечитывать файл на каждый запрос
+_hash_cache = OrderedDict()
+_hash_cache_lock = threading.Lock()
+
+
+def file_digest(path):
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _hash_cache_lock:
+        cached = _hash_cache.get(path)
+        if cached and cached[:2] == key:
+            _hash_cache.move_to_end(path)
+            return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()
+
+    with _hash_cache_lock:
+        _hash_cache[path] = (*key, value)
+        while len(_hash_cache) > HASH_CACHE_SIZE:
+            _hash_cache.popitem(last=False)
+    return value
+
+
+def init_file_serving(app):
+    app.config.setdefault("FILE_OFFLOAD", None)
+    app.config.setdefault("FILE_OFFLOAD_PREFIX", "/protected")
+    app.config.setdefault("UPLOAD_MAX_AGE", IMMUTABLE_MAX_AGE)
+    if app.config["FILE_OFFLOAD"] == "x-sendfile":
+        app.use_x_sendfile = True
+
+
+def send_upload(directory, filename, etag=None, immutable=True):
+    """Отдаёт файл filename из directory.
+
+    etag — хеш содержимого, если он уже известен (иначе считается и
+    кэшируется по mtime/размеру файла).
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    config = current_app.config
+    etag = etag or file_digest(path)
+
+    if config["FILE_OFFLOAD"] == "x-accel":
+        return _accel_redirect(path, filename, etag, immutable)
+
+    response = send_file(
+        path,
+        etag=etag,
+        conditional=True,
+        max_age=config["UPLOAD_MAX_AGE"] if immutable else None,
+    )
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
+def _accel_redirect(path, filename, etag, immutable):
+    # Повторный просмотр отвечаем 304 сами, остальное отдаёт nginx (включая Range)
+    response = current_app.response_class()
+    response.set_etag(etag)
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.cache_control.max_age = current_app.config["UPLOAD_MAX_AGE"]
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+
+    prefix = current_app.config["FILE_OFFLOAD_PREFIX"].rstrip("/")
+    response.headers["X-Accel-Redirect"] = f"{prefix}/{filename.lstrip('/')}"
+    response.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return response
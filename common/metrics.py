@@ -0,0 +1,212 @@
+"""Метрики производительности запросов: заголовок Server-Timing и /metrics.
+
+За запрос собирается время частей — SQL, рендер шаблонов, хеширование
+паролей, запись загрузок — и отдаётся клиенту заголовком Server-Timing
+(видно во вкладке Network браузера):
+
+    Server-Timing: app;dur=41.2, sql;dur=12.8;desc="5 queries", template;dur=9.1
+
+Итоги копятся в памяти процесса и отдаются по METRICS_PATH (по умолчанию
+/metrics) в текстовом формате Prometheus:
+
+    http_request_duration_seconds      — гистограмма по маршруту и методу;
+    http_requests_total                — число ответов по маршруту и коду;
+    request_component_seconds_total    — время частей запроса по маршруту;
+    request_component_calls_total      — число SQL-запросов, рендеров и т.п.;
+    upload_bytes_total                 — записанные байты загрузок; скорость
+                                         записи — upload_bytes_total, делённый
+                                         на время части upload.
+
+Накладные расходы — несколько вызовов perf_counter() и словарных операций
+на запрос и на SQL-запрос, поэтому метрики можно не выключать.
+
+Счётчики у каждого процесса свои: при нескольких воркерах /metrics
+показывает данные того воркера, который ответил.
+
+    init_metrics(app, sql=True)   # sql=True — для приложений на SQLAlchemy
+
+Свой код измеряется через timed("имя") или record("имя", секунды), а
+calls("sql") даёт число SQL-запросов текущего запроса (им пользуется лимит
+запросов в prj/querycount.py).
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Время обработки запроса"),
+    "http_requests_total": ("counter", "Число ответов"),
+    "request_component_seconds_total": ("counter", "Время частей запроса (sql, template, hash, upload)"),
+    "request_component_calls_total": ("counter", "Число вызовов частей запроса"),
+    "upload_bytes_total": ("counter", "Записано байт загруженных файлов"),
+}
+
+_sql_listening = False
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _labels(labels):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+
+class Registry:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}  # (имя, метки) -> значение
+        self._histograms = {}  # (имя, метки) -> [число по корзинам..., +Inf, сумма]
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple((label, str(v)) for label, v in labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple((label, str(v)) for label, v in labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+        lines = []
+        for name, (kind, help) in METRICS.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{{{_labels(labels)}}} {value}")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                total = 0
+                for bound, count in zip(self.buckets + ("+Inf",), histogram):
+                    total += count
+                    lines.append(f"{name}_bucket{{{_labels(labels + (('le', bound),))}}} {total}")
+                lines.append(f"{name}_sum{{{_labels(labels)}}} {histogram[-1]}")
+                lines.append(f"{name}_count{{{_labels(labels)}}} {total}")
+        return "\n".join(lines) + "\n"
+
+
+def record(name, seconds, calls=1):
+    """Добавляет время части текущего запроса (вне запроса ничего не делает)."""
+    if has_request_context():
+        timings = g.get("metrics_timings")
+        if timings is not None:
+            timing = timings.setdefault(name, [0.0, 0])
+            timing[0] += seconds
+            timing[1] += calls
+
+
+def calls(name):
+    """Сколько раз часть name встретилась в текущем запросе (например, SQL-запросов)."""
+    timing = g.get("metrics_timings", {}).get(name) if has_request_context() else None
+    return timing[1] if timing else 0
+
+
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def record_upload(size, seconds):
+    """Записанная загрузка: время идёт в часть upload, байты — в upload_bytes_total."""
+    record("upload", seconds)
+    if has_request_context() and g.get("metrics_timings") is not None:
+        registry = current_app.extensions.get("metrics")
+        if registry is not None:
+            registry.inc("upload_bytes_total", {"endpoint": request.endpoint or "<unmatched>"}, size)
+
+
+def _listen_sql():
+    global _sql_listening
+    if _sql_listening:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _sql_started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("metrics_started")
+        if started:
+            record("sql", time.perf_counter() - started.pop())
+
+    _sql_listening = True
+
+
+def init_metrics(app, sql=False):
+    app.config.setdefault("METRICS_PATH", "/metrics")  # None — не отдавать
+    app.config.setdefault("SERVER_TIMING", True)
+    registry = app.extensions["metrics"] = Registry()
+    if sql:
+        _listen_sql()
+
+    @app.before_request
+    def start_timing():
+        g.metrics_started = time.perf_counter()
+        g.metrics_timings = {}
+
+    def template_started(sender, template, context, **extra):
+        g.setdefault("metrics_templates", []).append(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        started = g.get("metrics_templates")
+        if started:
+            record("template", time.perf_counter() - started.pop())
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    @app.after_request
+    def finish_timing(response):
+        started = g.pop("metrics_started", None)
+        # metrics_timings остаётся в g до конца запроса: по нему calls()
+        if started is None:
+            return response
+        timings = g.metrics_timings
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or "<unmatched>"
+        registry.observe(
+            "http_request_duration_seconds", {"endpoint": endpoint, "method": request.method}, elapsed
+        )
+        registry.inc("http_requests_total", {"endpoint": endpoint, "status": response.status_code})
+        parts = [f"app;dur={elapsed * 1000:.1f}"]
+        for name, (seconds, calls) in timings.items():
+            labels = {"endpoint": endpoint, "component": name}
+            registry.inc("request_component_seconds_total", labels, seconds)
+            registry.inc("request_component_calls_total", labels, calls)
+            desc = f';desc="{calls} queries"' if name == "sql" else ""
+            parts.append(f"{name};dur={seconds * 1000:.1f}{desc}")
+        if app.config["SERVER_TIMING"]:
+            response.headers["Server-Timing"] = ", ".join(parts)
+        return response
+
+    if app.config["METRICS_PATH"]:
+        @app.route(app.config["METRICS_PATH"], endpoint="metrics")
+        def metrics():
+            return app.response_class(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return registry
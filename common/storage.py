@@ -0,0 +1,228 @@
+"""Контентно-адресуемое хранилище загрузок.
+
+Файл хранится один раз под именем sha256 содержимого в шардированных папках
+("ab/cd/abcd...ef.png"); сколько записей приложения на него ссылается,
+учитывается счётчиком ссылок в индексе SQLite. Блобы без ссылок удаляет
+collect_garbage().
+
+Сами байты лежат в бэкенде (BlobBackend). LocalBackend пишет в локальную
+папку; бэкенд для S3-совместимого хранилища реализует те же методы.
+"""
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from common.metrics import record_upload
+
+CHUNK_SIZE = 1024 * 1024
+Blob = namedtuple("Blob", "key created size")
+KEY_RE = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[0-9a-z]+)?$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blob (
+    key TEXT PRIMARY KEY,
+    refcount INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_blob_unreferenced ON blob (updated_at) WHERE refcount <= 0;
+"""
+
+
+def make_key(digest, ext=""):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}"
+
+
+def key_digest(key):
+    """sha256 содержимого для ключа хранилища или None для посторонних имён."""
+    match = KEY_RE.match(key or "")
+    return match.group(1) if match else None
+
+
+class BlobBackend:
+    """Куда физически записываются блобы. Ключ — путь вида "ab/cd/<sha256>.ext"."""
+
+    def write_from(self, tmp_path, key):
+        """Забирает временный файл tmp_path под ключ key (файл перемещается)."""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def iter_keys(self):
+        """Все ключи бэкенда вместе с временем изменения: (key, mtime)."""
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """Путь на локальном диске, если он есть (иначе None)."""
+        return None
+
+
+class LocalBackend(BlobBackend):
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def write_from(self, tmp_path, key):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(tmp_path, path)
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def iter_keys(self):
+        for first in os.listdir(self.root) if os.path.isdir(self.root) else ():
+            if not re.fullmatch(r"[0-9a-f]{2}", first):
+                continue
+            for dirpath, _, filenames in os.walk(os.path.join(self.root, first)):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                    if key_digest(key):
+                        yield key, os.path.getmtime(path)
+
+    def local_path(self, key):
+        return self._path(key)
+
+
+class ContentStore:
+    def __init__(self, backend, index_path, tmp_dir=None, grace_period=3600):
+        self.backend = backend
+        self.index_path = index_path
+        self.tmp_dir = tmp_dir
+        # Блоб без ссылок живёт ещё grace_period секунд перед удалением
+        self.grace_period = grace_period
+        self._ready = False
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE берёт блокировку записи SQLite: put() и
+        # collect_garbage() не пересекаются даже между процессами
+        connection = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+        try:
+            if not self._ready:
+                connection.executescript(SCHEMA)
+                self._ready = True
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def put(self, stream, ext=""):
+        """Сохраняет поток и добавляет ссылку на него.
+
+        Возвращает Blob(key, created, size); created=False, если такое
+        содержимое уже было в хранилище.
+        """
+        if self.tmp_dir:
+            os.makedirs(self.tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        started = time.perf_counter()
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+
+            key = make_key(digest.hexdigest(), ext)
+            with self._transaction() as connection:
+                connection.execute(
+                    "INSERT INTO blob (key, refcount, size, updated_at) VALUES (?, 1, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET refcount = refcount + 1, updated_at = excluded.updated_at",
+                    (key, size, time.time()),
+                )
+                created = not self.backend.exists(key)
+                if created:
+                    self.backend.write_from(tmp_path, key)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        record_upload(size, time.perf_counter() - started)
+        return Blob(key, created, size)
+
+    def incref(self, key, count=1):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE blob SET refcount = refcount + ?, updated_at = ? WHERE key = ?",
+                (count, time.time(), key),
+            )
+
+    def decref(self, key, count=1):
+        """Убирает ссылку. Ключи не из хранилища (старые имена файлов) игнорируются."""
+        if not key_digest(key):
+            return
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE blob SET refcount = MAX(refcount - ?, 0), updated_at = ? WHERE key = ?",
+                (count, time.time(), key),
+            )
+
+    def refcount(self, key):
+        with self._transaction() as connection:
+            row = connection.execute("SELECT refcount FROM blob WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def sync_refcounts(self, counts):
+        """Выставляет счётчики по фактическим ссылкам {key: число} из приложения.
+
+        Ключи индекса, которых нет в counts, получают 0 и уйдут при сборке мусора.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("UPDATE blob SET refcount = 0, updated_at = ? WHERE refcount != 0", (now,))
+            for key, count in counts.items():
+                if key_digest(key) and self.backend.exists(key):
+                    connection.execute(
+                        "INSERT INTO blob (key, refcount, size, updated_at) VALUES (?, ?, 0, ?) "
+                        "ON CONFLICT (key) DO UPDATE SET refcount = excluded.refcount",
+                        (key, count, now),
+                    )
+
+    def collect_garbage(self, now=None):
+        """Удаляет блобы без ссылок и файлы бэкенда, которых нет в индексе.
+
+        Трогает только то, что старше grace_period. Возвращает удалённые ключи.
+        """
+        deadline = (now or time.time()) - self.grace_period
+        removed = []
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT key FROM blob WHERE refcount <= 0 AND updated_at < ?", (deadline,)
+            ).fetchall()
+            for (key,) in rows:
+                self.backend.delete(key)
+                removed.append(key)
+            connection.executemany("DELETE FROM blob WHERE key = ?", rows)
+
+            known = {key for (key,) in connection.execute("SELECT key FROM blob")}
+            for key, mtime in list(self.backend.iter_keys()):
+                if key not in known and mtime < deadline:
+                    self.backend.delete(key)
+                    removed.append(key)
+        return removed
@@ -0,0 +1,181 @@
+"""Фоновая очередь задач без внешнего брокера.
+
+Задачи выполняются пулом потоков внутри процесса приложения, а записи о них
+хранятся в локальной SQLite-базе: статус можно узнать по id, а задачи,
+не доведённые до конца из-за падения процесса, перезапускаются при старте.
+
+    queue = TaskQueue("jobs.db")
+
+    @queue.task
+    def process_upload(filename):
+        ...
+
+    job_id = process_upload.delay("photo.png")
+    queue.status(job_id)  # {"status": "done", "result": ..., ...}
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    args TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    pid INTEGER,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+)
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class TaskQueue:
+    def __init__(self, path, workers=2, eager=False):
+        self.path = path
+        self.workers = workers
+        # eager=True выполняет задачи сразу в вызывающем потоке (для тестов)
+        self.eager = eager
+        self.tasks = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute("PRAGMA journal_mode = WAL")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def start(self):
+        """Создаёт хранилище и пул потоков (один раз) и подхватывает брошенные задачи."""
+        with self._lock:
+            if self._executor is not None:
+                return
+            with self._connect() as connection:
+                connection.execute(SCHEMA)
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="tasks")
+        self.recover()
+
+    def task(self, f):
+        self.tasks[f.__name__] = f
+        f.delay = lambda *args: self.enqueue(f.__name__, *args)
+        return f
+
+    def enqueue(self, name, *args):
+        if name not in self.tasks:
+            raise KeyError(f"Неизвестная задача: {name}")
+        self.start()
+        job_id = uuid.uuid4().hex
+        now = _now()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO job (id, name, args, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, name, json.dumps(args), QUEUED, now, now),
+            )
+        self._submit(job_id)
+        return job_id
+
+    def _submit(self, job_id):
+        if self.eager:
+            self._run(job_id)
+        else:
+            self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        # Захват задачи атомарным UPDATE: при нескольких процессах её выполнит один
+        with self._connect() as connection:
+            claimed = connection.execute(
+                "UPDATE job SET status = ?, pid = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (RUNNING, os.getpid(), _now(), job_id, QUEUED),
+            ).rowcount
+            row = connection.execute("SELECT name, args FROM job WHERE id = ?", (job_id,)).fetchone()
+        if not claimed:
+            return
+
+        try:
+            result = self.tasks[row["name"]](*json.loads(row["args"]))
+        except Exception:
+            logger.exception("Задача %s (%s) завершилась с ошибкой", row["name"], job_id)
+            status, result, error = FAILED, None, traceback.format_exc(limit=5)
+        else:
+            status, error = DONE, None
+
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE job SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result), error, _now(), job_id),
+            )
+
+    def recover(self):
+        """Возвращает в очередь задачи, чей процесс-исполнитель больше не жив."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT id, status, pid FROM job WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+            orphaned = [row["id"] for row in rows
+                        if row["status"] == RUNNING and not _pid_alive(row["pid"])]
+            connection.executemany(
+                "UPDATE job SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                [(QUEUED, _now(), job_id, RUNNING) for job_id in orphaned],
+            )
+        for row in rows:
+            if row["status"] == QUEUED or row["id"] in orphaned:
+                self._submit(row["id"])
+
+    def status(self, job_id):
+        self.start()
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM job WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "name": row["name"],
+            "status": row["status"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,41 @@
+"""Встроенные в код шаблоны как обычные шаблоны Jinja.
+
+render_template_string() компилирует исходник шаблона при каждом вызове.
+init_templates() регистрирует строки-шаблоны под именами через DictLoader
+и компилирует их один раз при старте; дальше render_template(имя) берёт
+готовый шаблон из кэша окружения Jinja.
+
+Шаблоны можно скомпилировать заранее в модули Python:
+
+    flask --app wsgi compile-templates build/templates
+
+и указать папку в TEMPLATE_MODULES — тогда при старте не компилируется
+ничего. Модули не следят за исходниками: после правки шаблона их нужно
+пересобрать.
+"""
+import os
+
+import click
+from jinja2 import ChoiceLoader, DictLoader, ModuleLoader
+
+
+def init_templates(app, templates):
+    """templates — {имя: исходник}; имена с .html, чтобы работало автоэкранирование."""
+    app.config.setdefault("TEMPLATE_MODULES", os.environ.get("TEMPLATE_MODULES"))
+    app.jinja_loader = DictLoader(templates)
+    module_dir = app.config["TEMPLATE_MODULES"]
+    if module_dir and os.path.isdir(module_dir):
+        # Загрузчик Flask умеет отдавать только исходники, поэтому модули
+        # подключаются к окружению Jinja перед ним
+        app.jinja_env.loader = ChoiceLoader([ModuleLoader(module_dir), app.jinja_env.loader])
+
+    for name in templates:
+        app.jinja_env.get_template(name)
+
+    @app.cli.command("compile-templates")
+    @click.argument("target")
+    def compile_templates(target):
+        """Скомпилировать встроенные шаблоны в модули Python (для TEMPLATE_MODULES)."""
+        env = app.jinja_env.overlay(loader=DictLoader(templates))
+        env.compile_templates(target, zip=None, ignore_errors=False)
+        print(f"Скомпилировано шаблонов: {len(templates)} -> {target}")
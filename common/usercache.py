@@ -0,0 +1,86 @@
+"""Кэш пользователей для user_loader Flask-Login.
+
+Без кэша каждый запрос авторизованного пользователя начинается с
+SELECT по первичному ключу. Здесь хранятся значения колонок пользователя
+с коротким TTL; при попадании объект присоединяется к текущей сессии через
+merge(load=False) без обращения к базе, поэтому ленивые связи
+(current_user.cart_items и т.п.) продолжают работать.
+
+Кэш локален для процесса: invalidate() сбрасывает запись только в своём
+воркере, в остальных она устареет не позже чем через ttl секунд.
+
+    user_cache = UserCache(db, User, ttl=30)
+
+    @login_manager.user_loader
+    def load_user(user_id):
+        return user_cache.load(user_id)
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+
+class UserCache:
+    def __init__(self, db, model, ttl=30, max_size=10000):
+        self.db = db
+        self.model = model
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._columns = [column.key for column in inspect(model).column_attrs]
+        self._entries = OrderedDict()  # id -> (срок годности, значения колонок)
+        self._lock = threading.Lock()
+
+    def load(self, user_id):
+        user_id = int(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                self._entries.move_to_end(user_id)
+                values = entry[1]
+            else:
+                self.misses += 1
+                values = None
+
+        if values is not None:
+            user = self.model(**values)
+            make_transient_to_detached(user)
+            return self.db.session.merge(user, load=False)
+
+        user = self.db.session.get(self.model, user_id)
+        if user is not None:
+            self.store(user)
+        return user
+
+    def store(self, user):
+        values = {key: getattr(user, key) for key in self._columns}
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(int(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+                "ttl": self.ttl,
+            }
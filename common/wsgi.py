@@ -0,0 +1,70 @@
+"""Запуск приложений под WSGI-сервером с предзагрузкой.
+
+Каждое приложение собирается функцией create_app(), а его wsgi.py делает
+
+    app = preload(create_app(), warm_up)
+
+С gunicorn --preload это выполняется один раз в мастер-процессе: шаблоны
+скомпилированы, данные warm_up загружены, и воркеры получают всё готовым
+через fork, разделяя страницы памяти copy-on-write. Воркер стартует за
+время fork().
+
+Чего в мастере быть не должно — открытых соединений с базой и потоков:
+после fork их нельзя делить между процессами. Пулы потоков (хеширование
+паролей, фоновые задачи) создаются при первом использовании, пул хеширования
+после fork создаётся заново; пулы соединений SQLAlchemy preload() закрывает.
+Схему базы create_app() создаёт и мигрирует до fork, один раз в мастере.
+"""
+import gc
+import os
+
+
+def preload(app, *warm_ups):
+    try:
+        templates = app.jinja_env.list_templates()
+    except TypeError:
+        # ModuleLoader (TEMPLATE_MODULES) не умеет перечислять шаблоны;
+        # встроенные шаблоны init_templates() уже скомпилировал
+        templates = []
+    for name in templates:
+        app.jinja_env.get_template(name)
+
+    for warm_up in warm_ups:
+        warm_up()
+
+    db = app.extensions.get("sqlalchemy")
+    if db is not None:
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+
+    # Загруженное к этому моменту живёт до конца процесса: сборщик мусора
+    # воркеров не будет обходить эти объекты и трогать их страницы
+    gc.freeze()
+    return app
+
+
+def load_secret_key(path):
+    """SECRET_KEY из окружения или из файла path (создаётся при первом запуске).
+
+    Ключ должен быть одинаковым у всех воркеров и переживать перезапуск,
+    иначе сессии и CSRF-токены перестают проверяться.
+    """
+    key = os.environ.get("SECRET_KEY")
+    if key:
+        return key
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="ascii") as f:
+            f.write(os.urandom(32).hex())
+        try:
+            # link() не заменяет существующий файл: если воркеры стартуют
+            # одновременно, все получат ключ того, кто успел первым
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, "r", encoding="ascii") as f:
+        return f.read().strip()
@@ -1,20 +1,86 @@
-from flask import Flask, request, render_template_string
+from flask import Flask, request, render_template
 import random
+import threading
 import unittest
 import os
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
 
-app = Flask(__name__)
+# Общие модули репозитория (пакет common) лежат уровнем выше
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Генерация
-def generate_numbers():
-    numbers = set()
-    while len(numbers) < 1000:
+from common.metrics import init_metrics
+from common.templates import init_templates
 
-        num = '89' + ''.join(str(random.randint(0, 9)) for _ in range(9))
-        numbers.add(num)
-    return sorted(numbers)
+app = Flask(__name__)
 
-PHONE_NUMBERS = generate_numbers()
+PHONE_PREFIX = "89"
+PHONE_DIGITS = 9  # цифр после префикса
+PHONE_COUNT = int(os.environ.get("PHONE_COUNT", 1000))
+PHONE_SEED = os.environ.get("PHONE_SEED")  # для воспроизводимого набора
+PER_PAGE = 100
+SEARCH_LIMIT = 20
+
+# Генерация: count разных номеров одним вызовом sample() без перебора цифр.
+# Храним только 9 цифр после "89" числами в отсортированном массиве
+# (8 байт на номер), строки собираются при выводе.
+def generate_numbers(count=PHONE_COUNT, seed=None):
+    rng = random.Random(seed)
+    return array("q", sorted(rng.sample(range(10 ** PHONE_DIGITS), count)))
+
+
+def format_number(value):
+    return f"{PHONE_PREFIX}{value:0{PHONE_DIGITS}d}"
+
+
+class PhoneBook:
+    """Номера, сгенерированные при первом обращении, с поиском по префиксу."""
+
+    def __init__(self, count=PHONE_COUNT, seed=PHONE_SEED):
+        self.count = count
+        self.seed = seed
+        self._numbers = None
+        self._lock = threading.Lock()
+
+    @property
+    def numbers(self):
+        if self._numbers is None:
+            with self._lock:
+                if self._numbers is None:
+                    self._numbers = generate_numbers(self.count, self.seed)
+        return self._numbers
+
+    def __len__(self):
+        return self.count
+
+    def page(self, page, per_page=PER_PAGE):
+        start = (page - 1) * per_page
+        return [format_number(value) for value in self.numbers[start:start + per_page]]
+
+    def search(self, prefix, limit=SEARCH_LIMIT):
+        """Номера, начинающиеся с prefix: (первые limit совпадений, всего совпадений).
+
+        Двоичный поиск по отсортированному массиву, O(log n) на запрос.
+        """
+        if not prefix.isdigit():
+            return [], 0
+        if len(prefix) <= len(PHONE_PREFIX):
+            if not PHONE_PREFIX.startswith(prefix):
+                return [], 0
+            low, high = 0, 10 ** PHONE_DIGITS - 1
+        else:
+            rest = prefix[len(PHONE_PREFIX):]
+            if not prefix.startswith(PHONE_PREFIX) or len(rest) > PHONE_DIGITS:
+                return [], 0
+            low = int(rest.ljust(PHONE_DIGITS, "0"))
+            high = int(rest.ljust(PHONE_DIGITS, "9"))
+        numbers = self.numbers
+        start, end = bisect_left(numbers, low), bisect_right(numbers, high)
+        return [format_number(value) for value in numbers[start:min(end, start + limit)]], end - start
+
+
+PHONE_BOOK = PhoneBook()
 
 INDEX_TEMPLATE = """
 <!doctype html>
@@ -38,6 +104,12 @@ INDEX_TEMPLATE = """
             </li>
         {% endfor %}
     </ul>
+
+    <p>
+        {% if page > 1 %}<a href="/?page={{ page - 1 }}">Назад</a>{% endif %}
+        Страница {{ page }} из {{ pages }}
+        {% if page < pages %}<a href="/?page={{ page + 1 }}">Вперёд</a>{% endif %}
+    </p>
 </body>
 </html>
 """
@@ -54,24 +126,64 @@ NUMBER_TEMPLATE = """
     <p>Введённое значение:</p>
     <strong>{{ number }}</strong>
 
+    {% if total %}
+        <p>Номеров с таким началом: {{ total }}{% if total > matches|length %} (показаны первые {{ matches|length }}){% endif %}</p>
+        <ul>
+            {% for num in matches %}
+                <li>{{ num }}{% if num == number %} — есть в списке{% endif %}</li>
+            {% endfor %}
+        </ul>
+    {% elif number %}
+        <p>Номеров с таким началом нет</p>
+    {% endif %}
+
     <p><a href="/">Вернуться к списку</a></p>
 </body>
 </html>
 """
 
+_configured = False
+
+
+def create_app(config=None):
+    """Настраивает приложение (один раз) и возвращает его.
+
+    Маршруты объявлены на модульном app; здесь — всё, что зависит от
+    настроек или выполняется при старте.
+    """
+    global _configured
+    if config:
+        app.config.update(config)
+    if not _configured:
+        init_metrics(app)
+        # Шаблоны компилируются один раз при старте
+        init_templates(app, {"index.html": INDEX_TEMPLATE, "number.html": NUMBER_TEMPLATE})
+        _configured = True
+    return app
+
+
+def warm_up():
+    """Генерирует номера заранее (в мастер-процессе при gunicorn --preload)."""
+    PHONE_BOOK.numbers
+
 @app.route("/")
 def index():
-    return render_template_string(INDEX_TEMPLATE, numbers=PHONE_NUMBERS)
+    pages = max(1, -(-len(PHONE_BOOK) // PER_PAGE))
+    page = min(max(request.args.get("page", 1, type=int), 1), pages)
+    return render_template(
+        "index.html", numbers=PHONE_BOOK.page(page), page=page, pages=pages
+    )
 
 @app.route("/number/")
 def number_info():
     number = request.args.get("number", "")
-    return render_template_string(NUMBER_TEMPLATE, number=number)
+    matches, total = PHONE_BOOK.search(number.strip())
+    return render_template("number.html", number=number, matches=matches, total=total)
 
 
 class FlaskAppTestCase(unittest.TestCase):
     def setUp(self):
-        self.client = app.test_client()
+        self.client = create_app().test_client()
         self.client.testing = True
 
     def test_index_page_loads(self):
@@ -92,6 +204,44 @@ class FlaskAppTestCase(unittest.TestCase):
         text = response.get_data(as_text=True)
         self.assertIn("test-string", text)
 
+    def test_generator_is_reproducible_with_seed(self):
+        first = generate_numbers(500, seed=42)
+        self.assertEqual(first, generate_numbers(500, seed=42))
+        self.assertEqual(len(set(first)), 500)
+        self.assertEqual(list(first), sorted(first))
+
+    def test_index_is_paginated(self):
+        text = self.client.get("/").get_data(as_text=True)
+        self.assertEqual(text.count("<li>"), min(PER_PAGE, len(PHONE_BOOK)))
+        second = self.client.get("/?page=2").get_data(as_text=True)
+        self.assertIn(PHONE_BOOK.page(2)[0], second)
+        self.assertNotIn(PHONE_BOOK.page(2)[0], text)
+
+    def test_prefix_search(self):
+        book = PhoneBook(1000, seed=1)
+        number = book.page(5)[3]
+        matches, total = book.search(number)
+        self.assertEqual(matches, [number])
+        self.assertEqual(total, 1)
+        matches, total = book.search(number[:5], limit=1000)
+        self.assertIn(number, matches)
+        self.assertEqual(len(matches), total)
+        self.assertTrue(all(m.startswith(number[:5]) for m in matches))
+        self.assertEqual(book.search("8")[1], 1000)
+        self.assertEqual(book.search("79")[1], 0)
+
+    def test_number_page_shows_match(self):
+        number = PHONE_BOOK.page(1)[0]
+        text = self.client.get(f"/number/?number={number}").get_data(as_text=True)
+        self.assertIn("есть в списке", text)
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get("/")
+        self.assertIn("template;dur=", response.headers["Server-Timing"])
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn('http_requests_total{endpoint="index",status="200"}', text)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="index",method="GET",le="+Inf"}', text)
+
     def test_number_page_empty(self):
         response = self.client.get("/number/")
         self.assertEqual(response.status_code, 200)
@@ -100,4 +250,4 @@ class FlaskAppTestCase(unittest.TestCase):
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -1,24 +1,62 @@
 import os
+import sys
 import uuid
-import hashlib
-import json
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from flask import Flask, request, render_template_string, flash, redirect, url_for, send_from_directory
+from flask import Flask, request, render_template, flash, redirect, url_for, jsonify, abort
+from markupsafe import Markup
 
+# Общие модули репозитория (пакет common) лежат уровнем выше
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.fileserve import init_file_serving, send_upload
+from common.metrics import init_metrics
+from common.storage import ContentStore, LocalBackend, key_digest
+from common.tasks import TaskQueue
+from common.templates import init_templates
+from filestore import FileStore, import_json
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_FOLDER = "uploads"
-DATA_FILE = "files_data.json"
+DATA_FILE = os.path.join(BASE_DIR, "files_data.json")
 ALLOWED_EXTENSIONS = {'.txt', '.pdf', '.png', '.jpg', '.jpeg', '.gif'}  
 
+try:
+    from PIL import Image
+except ImportError:  # без Pillow размеры картинок не определяем
+    Image = None
+
 app = Flask(__name__)
-app.secret_key = "supersecretkey"
+app.secret_key = os.environ.get("SECRET_KEY", "supersecretkey")
+# Папка загрузок относительно папки приложения; она же — префикс URL файлов
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['FILES_PER_PAGE'] = 50
+# Метаданные, индекс хранилища и очередь задач (создаются в create_app)
+app.config['FILE_STORE_PATH'] = os.path.join(BASE_DIR, "files.db")
+app.config['CONTENT_STORE_PATH'] = os.path.join(BASE_DIR, "blobs.db")
+app.config['TASK_QUEUE_PATH'] = os.path.join(BASE_DIR, "jobs.db")
+
+# Отрендеренные фрагменты списка файлов (LRU)
+LIST_CACHE_SIZE = 128
+list_cache = OrderedDict()
+list_cache_lock = threading.Lock()
+
+
+def file_store():
+    return app.extensions['file_store']
 
 
-if os.path.exists(DATA_FILE):
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
-        files_data = json.load(f)
-else:
-    files_data = []
+def content_store():
+    return app.extensions['content_store']
+
+
+def task_queue():
+    return app.extensions['task_queue']
+
+
+def upload_root():
+    return os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
 
 
 def allowed_file(filename):
@@ -26,17 +64,22 @@ def allowed_file(filename):
     return ext in ALLOWED_EXTENSIONS
 
 
-def file_md5(file_path):
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+def process_upload(uuid_name):
+    store = file_store()
+    file_info = store.get(uuid_name)
+    if file_info is None:
+        return {"status": "missing"}
 
+    metadata = {}
+    if Image is not None and file_info['extension'] in {'.png', '.jpg', '.jpeg', '.gif'}:
+        try:
+            with Image.open(os.path.join(app.root_path, file_info['path'])) as image:
+                metadata['width'], metadata['height'] = image.size
+        except OSError:
+            pass
 
-def save_data():
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(files_data, f, indent=4, ensure_ascii=False)
+    store.update(uuid_name, **metadata)
+    return {"status": "ok", **metadata}
 
 
 HTML_TEMPLATE = """
@@ -65,6 +108,24 @@ HTML_TEMPLATE = """
     </form>
 
     <h2>Список загруженных файлов</h2>
+    <form method="get">
+        <select name="extension">
+            <option value="">Все типы</option>
+            {% for ext in extensions %}
+            <option value="{{ ext }}" {% if filters.extension == ext %}selected{% endif %}>{{ ext }}</option>
+            {% endfor %}
+        </select>
+        с <input type="date" name="date_from" value="{{ filters.date_from or '' }}">
+        по <input type="date" name="date_to" value="{{ filters.date_to or '' }}">
+        <button type="submit">Показать</button>
+    </form>
+    {{ file_list }}
+</body>
+</html>
+"""
+
+# Фрагмент со списком кэшируется целиком (см. render_file_list)
+FILE_LIST_TEMPLATE = """
     <ul>
     {% for file in files %}
         <li>
@@ -74,12 +135,89 @@ HTML_TEMPLATE = """
             Дата: {{ file['date'] }} | 
             <a href="{{ url_for('serve_file', path=file['path']) }}" target="_blank">Открыть файл</a>
         </li>
+    {% else %}
+        <li>Файлов нет</li>
     {% endfor %}
     </ul>
-</body>
-</html>
+    {% if next_cursor %}
+    <p><a href="{{ url_for('upload_file', after=next_cursor, **filters) }}">Следующая страница</a></p>
+    {% endif %}
 """
 
+_configured = False
+
+
+def create_app(config=None):
+    """Настраивает приложение (один раз) и возвращает его.
+
+    Маршруты объявлены на модульном app; здесь — всё, что зависит от
+    настроек или выполняется при старте.
+    """
+    global _configured
+    if config:
+        app.config.update(config)
+    if not _configured:
+        # Метаданные загрузок; при первом запуске переносятся из files_data.json
+        store = app.extensions['file_store'] = FileStore(app.config['FILE_STORE_PATH'])
+        # Сами файлы хранятся по хешу содержимого в шардах uploads/ab/cd/
+        app.extensions['content_store'] = ContentStore(
+            LocalBackend(upload_root()),
+            app.config['CONTENT_STORE_PATH'],
+            tmp_dir=os.path.join(upload_root(), ".tmp"),
+        )
+        # Сбор метаданных загрузок выполняется в фоне
+        app.extensions['task_queue'] = TaskQueue(app.config['TASK_QUEUE_PATH'])
+        task_queue().task(process_upload)
+        init_metrics(app)
+        init_file_serving(app)
+        # Шаблоны компилируются один раз при старте
+        init_templates(app, {"index.html": HTML_TEMPLATE, "file_list.html": FILE_LIST_TEMPLATE})
+        if store.version() is None and os.path.exists(DATA_FILE):
+            import_json(store, DATA_FILE)
+        _configured = True
+    return app
+
+
+def list_filters():
+    """Фильтры списка из query string; некорректные значения игнорируются."""
+    filters = {}
+    extension = request.args.get('extension', '')
+    if extension in ALLOWED_EXTENSIONS:
+        filters['extension'] = extension
+    for name in ('date_from', 'date_to'):
+        value = request.args.get(name, '')
+        try:
+            datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            continue
+        filters[name] = value
+    return filters
+
+
+def list_cursor():
+    return request.args.get('after', type=int)
+
+
+def render_file_list(filters, after):
+    # Ключ включает версию хранилища: новый файл делает старые записи недостижимыми
+    store = file_store()
+    key = (store.version(), tuple(sorted(filters.items())), after)
+    with list_cache_lock:
+        if key in list_cache:
+            list_cache.move_to_end(key)
+            return list_cache[key]
+
+    files, next_cursor = store.page(after=after, limit=app.config['FILES_PER_PAGE'], **filters)
+    html = Markup(render_template(
+        "file_list.html", files=files, next_cursor=next_cursor, filters=filters
+    ))
+    with list_cache_lock:
+        list_cache[key] = html
+        while len(list_cache) > LIST_CACHE_SIZE:
+            list_cache.popitem(last=False)
+    return html
+
+
 @app.route("/", methods=['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
@@ -98,43 +236,90 @@ def upload_file():
 
         uuid_name = str(uuid.uuid4()) + ext
 
+        # Хеш считается по ходу записи; одинаковое содержимое хранится один раз
+        blob = content_store().put(uploaded_file.stream, ext)
 
-        folder_path = os.path.join(app.config['UPLOAD_FOLDER'], uuid_name[:2], uuid_name[2:4])
-        os.makedirs(folder_path, exist_ok=True)
-
-        file_path = os.path.join(folder_path, uuid_name)
-        uploaded_file.save(file_path)
-
-
-        md5_hash = file_md5(file_path)
-        for f in files_data:
-            if f['md5'] == md5_hash:
-                os.remove(file_path)
-                flash("Файл уже загружен (дубликат)")
-                return redirect(request.url)
-
-
+        # Уникальный индекс по sha256: вставка сама проверяет дубликат
         file_info = {
             "uuid": uuid_name,
             "original_name": original_name,
             "extension": ext,
             "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "path": file_path.replace("\\", "/"),
-            "md5": md5_hash
+            "path": app.config['UPLOAD_FOLDER'] + "/" + blob.key,
+            "sha256": key_digest(blob.key),
+            "size": blob.size
         }
-        files_data.append(file_info)
-        save_data()
-        flash("Файл успешно загружен")
+        if not file_store().add(file_info):
+            content_store().decref(blob.key)
+            flash("Файл уже загружен (дубликат)")
+            return redirect(request.url)
+        with list_cache_lock:
+            list_cache.clear()
+        job_id = process_upload.delay(uuid_name)
+        flash(f"Файл успешно загружен (задача обработки {job_id})")
         return redirect(url_for('upload_file'))
 
-    return render_template_string(HTML_TEMPLATE, files=files_data)
+    filters = list_filters()
+    return render_template(
+        "index.html",
+        file_list=render_file_list(filters, list_cursor()),
+        filters=filters,
+        extensions=sorted(ALLOWED_EXTENSIONS),
+    )
+
+
+@app.route('/api/files')
+def api_files():
+    files, next_cursor = file_store().page(
+        after=list_cursor(), limit=app.config['FILES_PER_PAGE'], **list_filters()
+    )
+    for file_info in files:
+        file_info['url'] = url_for('serve_file', path=file_info['path'])
+    return jsonify(files=files, next_cursor=next_cursor)
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = task_queue().status(job_id)
+    if status is None:
+        abort(404)
+    return jsonify(status)
 
 @app.route('/uploads/<path:path>')
 def serve_file(path):
-    directory = os.path.dirname(path)
-    filename = os.path.basename(path)
-    return send_from_directory(directory, filename)
+    # path хранится вместе с папкой загрузок: "uploads/ab/cd/<uuid>.ext"
+    prefix = app.config['UPLOAD_FOLDER'].rstrip('/') + '/'
+    if not path.startswith(prefix):
+        abort(404)
+    key = path[len(prefix):]
+    etag = key_digest(key)
+    if etag is None:
+        # Старые файлы названы по uuid: хеш берём из записи
+        file_info = file_store().get(os.path.basename(path))
+        etag = file_info.get('sha256') if file_info else None
+    return send_upload(upload_root(), key, etag=etag)
+
+@app.cli.command("import-files-data")
+def import_files_data():
+    """Перенести записи из files_data.json в files.db."""
+    imported, skipped = import_json(file_store(), DATA_FILE)
+    print(f"Импортировано: {imported}, пропущено: {skipped}")
+
+
+@app.cli.command("gc-uploads")
+def gc_uploads():
+    """Удалить файлы хранилища, на которые не ссылается ни одна запись."""
+    prefix = app.config['UPLOAD_FOLDER'] + "/"
+    counts = {}
+    for path in file_store().paths():
+        if path.startswith(prefix):
+            counts[path[len(prefix):]] = 1
+    content_store().sync_refcounts(counts)
+    removed = content_store().collect_garbage()
+    print(f"Удалено файлов: {len(removed)}")
+
 
 if __name__ == "__main__":
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    create_app()
+    os.makedirs(upload_root(), exist_ok=True)
     app.run(debug=True)
@@ -0,0 +1,169 @@
+"""Хранилище метаданных загруженных файлов в SQLite.
+
+Заменяет files_data.json: запись добавляется одной строкой (без перезаписи
+всего файла), транзакции SQLite переживают падение процесса, а уникальный
+индекс по sha256 делает проверку на дубликат атомарной даже для нескольких
+воркеров.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file (
+    uuid TEXT PRIMARY KEY,
+    original_name TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    date TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT UNIQUE,
+    md5 TEXT,
+    size INTEGER,
+    width INTEGER,
+    height INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_file_md5 ON file (md5);
+CREATE INDEX IF NOT EXISTS ix_file_date ON file (date);
+CREATE INDEX IF NOT EXISTS ix_file_extension_date ON file (extension, date);
+"""
+
+COLUMNS = ("uuid", "original_name", "extension", "date", "path",
+           "sha256", "md5", "size", "width", "height")
+
+
+def _record(row):
+    return {key: row[key] for key in row.keys() if row[key] is not None and key != "id"}
+
+
+class FileStore:
+    def __init__(self, path):
+        self.path = path
+        self._ready = False
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            if not self._ready:
+                connection.executescript(SCHEMA)
+                self._ready = True
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def add(self, record):
+        """Добавляет запись. Возвращает False, если файл с таким sha256 уже есть."""
+        values = [record.get(column) for column in COLUMNS]
+        with self._connect() as connection:
+            cursor = connection.execute(
+                f"INSERT INTO file ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in COLUMNS)}) "
+                "ON CONFLICT (sha256) DO NOTHING",
+                values,
+            )
+        return cursor.rowcount == 1
+
+    def update(self, uuid_name, **fields):
+        fields = {key: value for key, value in fields.items() if key in COLUMNS}
+        if not fields:
+            return
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as connection:
+            connection.execute(
+                f"UPDATE file SET {assignments} WHERE uuid = ?",
+                [*fields.values(), uuid_name],
+            )
+
+    def delete(self, uuid_name):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM file WHERE uuid = ?", (uuid_name,))
+
+    def _one(self, column, value):
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT * FROM file WHERE {column} = ?", (value,)
+            ).fetchone()
+        return _record(row) if row else None
+
+    def get(self, uuid_name):
+        return self._one("uuid", uuid_name)
+
+    def find_by_sha256(self, sha256_hash):
+        return self._one("sha256", sha256_hash)
+
+    def find_by_md5(self, md5_hash):
+        return self._one("md5", md5_hash)
+
+    def page(self, extension=None, date_from=None, date_to=None, after=None, limit=50):
+        """Страница списка файлов в порядке загрузки (keyset по date и rowid).
+
+        date_from/date_to — даты "ГГГГ-ММ-ДД" включительно, after — курсор
+        из предыдущей страницы. Возвращает (записи, курсор следующей страницы).
+        """
+        conditions, params = [], []
+        if extension:
+            conditions.append("extension = ?")
+            params.append(extension)
+        if date_from:
+            conditions.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("date < date(?, '+1 day')")
+            params.append(date_to)
+        if after:
+            conditions.append("(date, rowid) > (SELECT date, rowid FROM file WHERE rowid = ?)")
+            params.append(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT rowid AS id, * FROM file {where} ORDER BY date, rowid LIMIT ?",
+                [*params, limit + 1],
+            ).fetchall()
+        next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+        return [_record(row) for row in rows[:limit]], next_cursor
+
+    def paths(self):
+        with self._connect() as connection:
+            for (path,) in connection.execute("SELECT path FROM file"):
+                yield path
+
+    def version(self):
+        """Меняется при каждом добавлении файла (для инвалидации кэша)."""
+        with self._connect() as connection:
+            return connection.execute("SELECT MAX(rowid) FROM file").fetchone()[0]
+
+    def count(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM file").fetchone()[0]
+
+
+def import_json(store, json_path, chunk_size=1024 * 1024):
+    """Однократный перенос записей из files_data.json в хранилище.
+
+    Для старых записей без sha256 хеш досчитывается по файлу на диске.
+    Возвращает (импортировано, пропущено как дубликаты).
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+
+    imported = skipped = 0
+    for record in records:
+        record = dict(record, path=record["path"].replace("\\", "/"))
+        if not record.get("sha256") and os.path.exists(record["path"]):
+            digest = hashlib.sha256()
+            with open(record["path"], "rb") as source:
+                for chunk in iter(lambda: source.read(chunk_size), b""):
+                    digest.update(chunk)
+            record["sha256"] = digest.hexdigest()
+        if store.get(record["uuid"]) is None and store.add(record):
+            imported += 1
+        else:
+            skipped += 1
+    return imported, skipped
@@ -0,0 +1,10 @@
+"""Точка входа WSGI (запускать из папки приложения):
+
+    gunicorn --preload -w 4 wsgi:app
+    flask --app wsgi run
+"""
+from app import create_app
+
+from common.wsgi import preload
+
+app = preload(create_app())
@@ -1,28 +1,31 @@
 import os
-import json
+import sys
 from datetime import datetime
-from flask import Flask, redirect, url_for, flash, render_template_string
+from flask import Flask, redirect, url_for, flash, render_template, request
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Length
-from werkzeug.security import generate_password_hash, check_password_hash
+
+# Общие модули репозитория (пакет common) лежат уровнем выше
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.auth import LoginGuard, TooManyAttempts
+from common.metrics import init_metrics
+from common.templates import init_templates
+from userstore import UserStore, import_json
 
 DATA_FILE = "users.json"
+DB_FILE = "users.db"
+USERS_PER_PAGE = 20
 
 app = Flask(__name__)
-app.secret_key = "secret_key_for_forms"
+app.secret_key = os.environ.get("SECRET_KEY", "secret_key_for_forms")
 
-def load_users():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+# Пользователи в SQLite; при первом запуске (create_app) переносим их из users.json
+store = UserStore(DB_FILE)
 
-def save_users(users):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, indent=4, ensure_ascii=False)
-
-users = load_users()
+# Проверка паролей: лимиты попыток и ограниченный пул хеширования
+auth = LoginGuard()
 
 
 class LoginForm(FlaskForm):
@@ -39,26 +42,28 @@ def is_bad_password(password):
     return password.isdigit() or password.isalpha()
 
 
-if "admin" not in users:
-    users["admin"] = {
-        "password": generate_password_hash("admin123"),
-        "registered_at": datetime.now().isoformat(),
-        "last_login": None
-    }
-    save_users(users)
-
-
 @app.route("/", methods=["GET", "POST"])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        user = users.get(form.username.data)
-        if user and check_password_hash(user["password"], form.password.data):
-            user["last_login"] = datetime.now().isoformat()
-            save_users(users)
+        user = store.get(form.username.data)
+        try:
+            result = auth.login(
+                form.username.data,
+                form.password.data,
+                user["password"] if user else None,
+                request.remote_addr,
+            )
+        except TooManyAttempts:
+            flash("Слишком много попыток входа, попробуйте позже")
+            return render_template("login.html", form=form), 429
+        if result.ok:
+            if result.new_hash:
+                store.set_password(form.username.data, result.new_hash)
+            store.record_login(form.username.data, datetime.now().isoformat())
             return redirect(url_for("register"))
         flash("Неверный логин или пароль")
-    return render_template_string(TEMPLATE_LOGIN, form=form)
+    return render_template("login.html", form=form)
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
@@ -66,7 +71,7 @@ def register():
     if form.validate_on_submit():
         username = form.username.data
 
-        if username in users:
+        if store.get(username) is not None:
             flash("Пользователь с таким логином уже существует")
             return redirect(url_for("register"))
 
@@ -74,14 +79,15 @@ def register():
             flash("Пароль слишком простой")
             return redirect(url_for("register"))
 
-        users[username] = {
-            "password": generate_password_hash(form.password.data),
-            "registered_at": datetime.now().isoformat(),
-            "last_login": None
-        }
-        save_users(users)
+        # Логин мог занять параллельный запрос: add() проверяет это атомарно
+        if not store.add(username, auth.hash(form.password.data), datetime.now().isoformat()):
+            flash("Пользователь с таким логином уже существует")
+            return redirect(url_for("register"))
         flash("Пользователь успешно создан")
-    return render_template_string(TEMPLATE_REGISTER, form=form, users=users)
+
+    after = request.args.get("after", type=int)
+    users, next_cursor = store.page(after, USERS_PER_PAGE)
+    return render_template("register.html", form=form, users=users, next_cursor=next_cursor)
 
 
 TEMPLATE_LOGIN = """
@@ -108,7 +114,7 @@ TEMPLATE_REGISTER = """
 
 <h3>Существующие пользователи</h3>
 <ul>
-{% for name, data in users.items() %}
+{% for name, data in users %}
     <li>
         {{ name }} |
         зарегистрирован: {{ data.registered_at }} |
@@ -116,11 +122,39 @@ TEMPLATE_REGISTER = """
     </li>
 {% endfor %}
 </ul>
+{% if next_cursor %}
+<a href="{{ url_for('register', after=next_cursor) }}">Дальше</a>
+{% endif %}
 
 {% for msg in get_flashed_messages() %}
 <p style="color:red">{{ msg }}</p>
 {% endfor %}
 """
 
+_configured = False
+
+
+def create_app(config=None):
+    """Настраивает приложение (один раз) и возвращает его.
+
+    Маршруты объявлены на модульном app; здесь — всё, что зависит от
+    настроек или выполняется при старте.
+    """
+    global _configured
+    if config:
+        app.config.update(config)
+    if not _configured:
+        init_metrics(app)
+        # Шаблоны компилируются один раз при старте
+        init_templates(app, {"login.html": TEMPLATE_LOGIN, "register.html": TEMPLATE_REGISTER})
+        if store.count() == 0 and os.path.exists(DATA_FILE):
+            import_json(store, DATA_FILE)
+        # Хеш пароля админа считается только при первом запуске
+        if store.get("admin") is None:
+            store.add("admin", auth.hash("admin123"), datetime.now().isoformat())
+        _configured = True
+    return app
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""Хранилище пользователей flask3 в SQLite.
+
+Заменяет users.json: каждая запись обновляется отдельно (без перезаписи
+всего файла), транзакции SQLite безопасны для нескольких воркеров, а
+поиск по логину идёт по первичному ключу.
+
+Время последнего входа не пишется на каждый вход: отметки копятся в
+памяти и сбрасываются одной транзакцией фоновым потоком раз в
+flush_interval секунд (а также при накоплении flush_size отметок, при
+остановке процесса и перед чтением ещё не записанной отметки). Если
+процесс убит, теряются отметки не более чем за flush_interval секунд.
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    registered_at TEXT NOT NULL,
+    last_login TEXT
+);
+"""
+
+
+def _record(row):
+    return {key: row[key] for key in row.keys() if key not in ("id", "username")}
+
+
+class UserStore:
+    def __init__(self, path, flush_interval=5, flush_size=100):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._ready = False
+        self._reset()
+        atexit.register(self.flush)
+        if hasattr(os, "register_at_fork"):
+            # Поток сброса не переживает fork: в дочернем процессе он
+            # запускается заново при первом входе
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._pending = {}  # username -> last_login, ещё не записанные
+        self._flusher = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            if not self._ready:
+                connection.executescript(SCHEMA)
+                self._ready = True
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def add(self, username, password, registered_at, last_login=None):
+        """Добавляет пользователя. Возвращает False, если логин уже занят."""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO user (username, password, registered_at, last_login) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (username) DO NOTHING",
+                (username, password, registered_at, last_login),
+            )
+        return cursor.rowcount == 1
+
+    def get(self, username):
+        with self._lock:
+            pending = username in self._pending
+        if pending:
+            self.flush()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT * FROM user WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None:
+            return None
+        return _record(row)
+
+    def set_password(self, username, password):
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE user SET password = ? WHERE username = ?", (password, username)
+            )
+
+    def record_login(self, username, when):
+        """Запоминает время входа; в базу оно попадёт при ближайшем сбросе."""
+        with self._lock:
+            self._pending[username] = when
+            due = len(self._pending) >= self.flush_size
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_periodically, name="userstore-flush", daemon=True
+                )
+                self._flusher.start()
+        if due:
+            self.flush()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logger.exception("Не удалось записать время входа")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with self._connect() as connection:
+            # max(): отметка из другого воркера могла оказаться новее
+            connection.executemany(
+                "UPDATE user SET last_login = MAX(COALESCE(last_login, ''), ?) WHERE username = ?",
+                [(when, username) for username, when in pending.items()],
+            )
+
+    def page(self, after=None, limit=20):
+        """Страница пользователей в порядке регистрации (keyset по rowid).
+
+        Возвращает (список (логин, запись), курсор следующей страницы).
+        """
+        self.flush()
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT rowid AS id, * FROM user WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (after or 0, limit + 1),
+            ).fetchall()
+        next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+        users = [(row["username"], _record(row)) for row in rows[:limit]]
+        return users, next_cursor
+
+    def count(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM user").fetchone()[0]
+
+
+def import_json(store, json_path):
+    """Однократный перенос пользователей из users.json. Возвращает число добавленных."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        users = json.load(f)
+    return sum(
+        store.add(username, data["password"], data["registered_at"], data.get("last_login"))
+        for username, data in users.items()
+    )
@@ -1,15 +1,34 @@
-from flask import Flask, redirect, url_for, request, render_template_string, flash
+import os
+import sys
+
+from flask import Flask, abort, redirect, url_for, request, render_template, flash, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import defer, undefer
 from flask_login import LoginManager, login_user, login_required, logout_user, UserMixin, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 from datetime import datetime
 
+# Общие модули репозитория (пакет common) лежат уровнем выше
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.auth import LoginGuard, TooManyAttempts
+from common.conditional import conditional, make_etag
+from common.metrics import init_metrics
+from common.templates import init_templates
+from common.usercache import UserCache
+
+FEED_PAGE_SIZE = 10
+EXCERPT_LENGTH = 300
+
 app = Flask(__name__)
-app.config["SECRET_KEY"] = "secret"
+app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "secret")
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///blog.db"
-db = SQLAlchemy(app)
+# Подключаются к app в create_app(), когда настройки уже известны
+db = SQLAlchemy()
 
-login_manager = LoginManager(app)
+login_manager = LoginManager()
 login_manager.login_view = "login"
 
 
@@ -26,32 +45,119 @@ class Post(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey("user.id"))
 
+    # Начало текста для ленты: считается в SQL, content целиком не грузится
+    excerpt = db.column_property(func.substr(content, 1, EXCERPT_LENGTH), deferred=True)
+    # По длине, а не по excerpt, видно, обрезан ли текст: пост ровно из
+    # EXCERPT_LENGTH символов показывается целиком
+    content_length = db.column_property(func.length(content), deferred=True)
+
+    # Лента идёт по (created_at, id) от новых к старым; id в SQLite — это
+    # rowid, он и так есть в каждом индексе
+    __table_args__ = (
+        db.Index("ix_post_public_feed", "is_private", "created_at"),
+        db.Index("ix_post_feed", "created_at"),
+    )
+
+class ChangeMarker(db.Model):
+    """Время последнего изменения области ("post") — для ETag/Last-Modified."""
+    scope = db.Column(db.String(50), primary_key=True)
+    changed_at = db.Column(db.DateTime, nullable=False)
+
+
+def touch(scope):
+    """Отметить изменение; записывается в той же транзакции, что и сами данные."""
+    db.session.merge(ChangeMarker(scope=scope, changed_at=datetime.utcnow()))
+
+
+def changed_at(scope):
+    marker = db.session.get(ChangeMarker, scope)
+    if marker is None:
+        # База без отметки (старая или пустая): считаем изменённой сейчас.
+        # Параллельный запрос мог вставить отметку первым — тогда берём его
+        db.session.add(ChangeMarker(scope=scope, changed_at=datetime.utcnow()))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+        marker = db.session.get(ChangeMarker, scope)
+    return marker.changed_at
+
+
+def posts_validators(**view_args):
+    """ETag/Last-Modified для анонимных читателей: одна выборка по первичному ключу
+    вместо ленты и рендера. Авторизованным страницу не проверяем — она своя у каждого."""
+    if current_user.is_authenticated:
+        return None
+    last_modified = changed_at("post")
+    return make_etag(request.full_path, last_modified.isoformat()), last_modified
+
+
+# Проверка паролей: лимиты попыток и ограниченный пул хеширования
+auth = LoginGuard()
+
+# Пользователь для current_user без SELECT на каждый запрос
+user_cache = UserCache(db, User, ttl=int(os.environ.get("USER_CACHE_TTL", 30)))
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(user_id)
+
+
+def visible_posts():
+    query = Post.query
+    if not current_user.is_authenticated:
+        query = query.filter_by(is_private=False)
+    return query
 
 
 @app.route("/")
+@conditional(posts_validators)
 def index():
-    if current_user.is_authenticated:
-        posts = Post.query.order_by(Post.created_at.desc()).all()
-    else:
-        posts = Post.query.filter_by(is_private=False).order_by(Post.created_at.desc()).all()
-    return render_template_string(TEMPLATE_INDEX, posts=posts)
+    """Лента по страницам (keyset): before — id последнего поста предыдущей страницы."""
+    query = visible_posts().options(defer(Post.content), undefer(Post.excerpt), undefer(Post.content_length))
+    before = request.args.get("before", type=int)
+    if before:
+        created_at = db.session.query(Post.created_at).filter_by(id=before).scalar()
+        if created_at is not None:
+            query = query.filter(tuple_(Post.created_at, Post.id) < (created_at, before))
+    posts = query.order_by(Post.created_at.desc(), Post.id.desc()).limit(FEED_PAGE_SIZE + 1).all()
+    next_cursor = posts[FEED_PAGE_SIZE - 1].id if len(posts) > FEED_PAGE_SIZE else None
+    return render_template("index.html", posts=posts[:FEED_PAGE_SIZE], next_cursor=next_cursor)
+
+@app.route("/post/<int:id>")
+@conditional(posts_validators)
+def view_post(id):
+    post = visible_posts().filter_by(id=id).first()
+    if post is None:
+        abort(404)
+    return render_template("post_view.html", post=post)
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
-        user = User.query.filter_by(username=request.form["username"]).first()
-        if user and check_password_hash(user.password, request.form["password"]):
+        username = request.form["username"]
+        user = User.query.filter_by(username=username).first()
+        try:
+            result = auth.login(
+                username, request.form["password"], user.password if user else None, request.remote_addr
+            )
+        except TooManyAttempts:
+            flash("Слишком много попыток входа, попробуйте позже")
+            return render_template("login.html"), 429
+        if result.ok:
+            if result.new_hash:
+                user.password = result.new_hash
+                db.session.commit()
             login_user(user)
             return redirect(url_for("index"))
         flash("Неверный логин или пароль")
-    return render_template_string(TEMPLATE_LOGIN)
+    return render_template("login.html")
 
 @app.route("/logout")
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for("index"))
 
@@ -66,9 +172,10 @@ def create_post():
             author_id=current_user.id
         )
         db.session.add(post)
+        touch("post")
         db.session.commit()
         return redirect(url_for("index"))
-    return render_template_string(TEMPLATE_POST)
+    return render_template("post.html")
 
 @app.route("/post/edit/<int:id>", methods=["GET", "POST"])
 @login_required
@@ -78,9 +185,15 @@ def edit_post(id):
         post.title = request.form["title"]
         post.content = request.form["content"]
         post.is_private = bool(request.form.get("is_private"))
+        touch("post")
         db.session.commit()
         return redirect(url_for("index"))
-    return render_template_string(TEMPLATE_POST, post=post)
+    return render_template("post.html", post=post)
+
+@app.route("/stats/user-cache")
+@login_required
+def user_cache_stats():
+    return jsonify(user_cache.stats())
 
 
 TEMPLATE_INDEX = """
@@ -97,8 +210,8 @@ TEMPLATE_INDEX = """
 <hr>
 
 {% for post in posts %}
-<h3>{{ post.title }}</h3>
-<p>{{ post.content }}</p>
+<h3><a href="/post/{{ post.id }}">{{ post.title }}</a></h3>
+<p>{{ post.excerpt }}{% if post.content_length > excerpt_length %}… <a href="/post/{{ post.id }}">Читать дальше</a>{% endif %}</p>
 {% if post.is_private %}
 <em>Приватный пост</em>
 {% endif %}
@@ -107,6 +220,22 @@ TEMPLATE_INDEX = """
 {% endif %}
 <hr>
 {% endfor %}
+
+{% if next_cursor %}
+<a href="{{ url_for('index', before=next_cursor) }}">Более старые посты</a>
+{% endif %}
+"""
+
+TEMPLATE_POST_VIEW = """
+<p><a href="/">Блог</a></p>
+<h2>{{ post.title }}</h2>
+<p>{{ post.content }}</p>
+{% if post.is_private %}
+<em>Приватный пост</em>
+{% endif %}
+{% if current_user.is_authenticated %}
+<p><a href="/post/edit/{{ post.id }}">Редактировать</a></p>
+{% endif %}
 """
 
 TEMPLATE_LOGIN = """
@@ -134,12 +263,48 @@ TEMPLATE_POST = """
 </form>
 """
 
+_configured = False
 
-if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
 
+def create_app(config=None):
+    """Настраивает приложение (один раз) и возвращает его.
 
+    Маршруты объявлены на модульном app; здесь — всё, что зависит от
+    настроек или выполняется при старте, включая создание схемы.
+    """
+    global _configured
+    if config:
+        app.config.update(config)
+    if not _configured:
+        db.init_app(app)
+        login_manager.init_app(app)
+        init_metrics(app, sql=True)
+        # Шаблоны компилируются один раз при старте
+        init_templates(
+            app,
+            {
+                "index.html": TEMPLATE_INDEX,
+                "login.html": TEMPLATE_LOGIN,
+                "post.html": TEMPLATE_POST,
+                "post_view.html": TEMPLATE_POST_VIEW,
+            },
+        )
+        app.jinja_env.globals["excerpt_length"] = EXCERPT_LENGTH
+        with app.app_context(), db.engine.begin() as connection:
+            # Воркеры, стартующие одновременно, создают схему по очереди
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            db.metadata.create_all(connection)
+            # create_all не трогает уже существующие таблицы: индексы ленты
+            # для старой базы создаём отдельно
+            for table_index in Post.__table__.indexes:
+                table_index.create(connection, checkfirst=True)
+        _configured = True
+    return app
+
+
+if __name__ == "__main__":
+    create_app()
+    with app.app_context():
         if not User.query.filter_by(username="admin").first():
             user = User(
                 username="admin",
@@ -1,5 +1,33 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+import click
+
+# Общие модули репозитория (пакет common) лежат уровнем выше
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.auth import LoginGuard, TooManyAttempts
+from common.fileserve import init_file_serving, send_upload
+from common.metrics import calls, init_metrics
+from common.storage import ContentStore, LocalBackend
+from common.tasks import TaskQueue
+from common.usercache import UserCache
+from common.wsgi import load_secret_key
 from models import db, User, Brand, Product, CartItem
-from flask import Flask, render_template, redirect, url_for, flash, request
+from cache import cached_page, init_cache, invalidate, prefetch_versions
+from cart import cart_lines, cart_summary, release_expired, remove_item, renew_reservations, reserve_item
+from catalog import paginate
+from querycount import QueryBudgetExceeded, init_query_counter
+from search import apply_search, rebuild_index
+from migrations import upgrade
+from sqlite_tuning import engine_options, init_sqlite
+from images import image_url, init_images, make_derivatives, remove_derivatives
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, abort, g
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
 from flask_login import (
     LoginManager,
     login_user,
@@ -7,24 +35,96 @@ from flask_login import (
     login_required,
     current_user,
 )
-import os
-import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from decimal import Decimal
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
 app = Flask(__name__)
-app.config["SECRET_KEY"] = os.urandom(256)
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(BASE_DIR, "app.db")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Пул соединений под многопоточные воркеры; PRAGMA (WAL и т.д.) — в init_sqlite
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options()
 app.config["UPLOAD_FOLDER"] = os.path.join(BASE_DIR, "static", "uploads")
+app.config["CATALOG_PAGE_SIZE"] = 20
+app.config["SQL_QUERY_BUDGET"] = 10
+# Кэш страниц: "sqlite" — общий для воркеров файл, "lru" — в памяти процесса
+# (только для одного воркера: инвалидацию в других процессах он не увидит)
+app.config["PAGE_CACHE"] = os.environ.get("PAGE_CACHE", "sqlite")
+app.config["PAGE_CACHE_PATH"] = os.path.join(BASE_DIR, "page_cache.db")
+# Сколько секунд товар в корзине остаётся зарезервированным
+app.config["CART_RESERVATION_TTL"] = 30 * 60
+# Очередь фоновых задач и индекс хранилища загрузок (создаются в create_app)
+app.config["TASK_QUEUE_PATH"] = os.path.join(BASE_DIR, "jobs.db")
+app.config["CONTENT_STORE_PATH"] = os.path.join(BASE_DIR, "blobs.db")
+
+_configured = False
+
+
+def create_app(config=None):
+    """Настраивает приложение (один раз) и возвращает его.
+
+    Маршруты объявлены на модульном app; здесь — всё, что зависит от
+    настроек или выполняется при старте, включая создание схемы и
+    миграции базы. SECRET_KEY — из окружения или
+    из файла .secret_key рядом с приложением, общий для всех воркеров.
+    """
+    global _configured
+    if config:
+        app.config.update(config)
+    if _configured:
+        return app
+    if not app.config.get("SECRET_KEY"):
+        app.config["SECRET_KEY"] = load_secret_key(os.path.join(BASE_DIR, ".secret_key"))
+    upload_folder = app.config["UPLOAD_FOLDER"]
+    os.makedirs(upload_folder, exist_ok=True)
+
+    # Постобработка загрузок (уменьшенные копии) выполняется в фоне
+    queue = app.extensions["task_queue"] = TaskQueue(app.config["TASK_QUEUE_PATH"])
+    queue.task(process_upload)
+    # Загрузки хранятся по хешу содержимого со счётчиком ссылок
+    app.extensions["content_store"] = ContentStore(
+        LocalBackend(upload_folder),
+        app.config["CONTENT_STORE_PATH"],
+        tmp_dir=os.path.join(upload_folder, ".tmp"),
+    )
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    init_metrics(app, sql=True)
+    init_sqlite(app, db)
+    init_query_counter(app)
+    init_file_serving(app)
+    init_images(app)
+    init_cache(app)
+    # Схема и миграции — до первого запроса: старая база иначе отдаёт цены
+    # в рублях как копейки и не имеет поискового индекса
+    with app.app_context():
+        upgrade(db.engine, db.metadata)
+    _configured = True
+    return app
 
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
-db.init_app(app)
+@app.context_processor
+def inject_cart_summary():
+    # Значок корзины в base.html: считается только если шаблон его запросит
+    def summary():
+        if "cart_summary" not in g:
+            g.cart_summary = cart_summary(db.session, current_user.id)
+        return g.cart_summary
 
-login_manager = LoginManager(app)
+    return {"cart_summary": summary}
+
+login_manager = LoginManager()
 login_manager.login_view = "login"
 
+# Проверка паролей: лимиты попыток и ограниченный пул хеширования
+auth = LoginGuard()
+
+# Пользователь для current_user без SELECT на каждый запрос
+user_cache = UserCache(db, User, ttl=int(os.environ.get("USER_CACHE_TTL", 30)))
+
 
 from functools import wraps
 from flask import flash, redirect, url_for
@@ -45,43 +145,137 @@ def role_required(role):
     return decorator
 
 
+def task_queue():
+    return app.extensions["task_queue"]
+
+
+def content_store():
+    return app.extensions["content_store"]
+
+
+def process_upload(filename):
+    make_derivatives(app.config["UPLOAD_FOLDER"], filename)
+    return {"filename": filename}
+
+
+def save_upload(file_storage):
+    """Сохраняет загруженный файл в хранилище по хешу содержимого.
+
+    Одинаковые файлы хранятся один раз. Уменьшенные копии готовятся
+    фоновой задачей; пока они не готовы, маршрут image_derivative
+    создаст нужную при первом запросе.
+    """
+    ext = os.path.splitext(file_storage.filename)[1]
+    blob = content_store().put(file_storage.stream, ext)
+    if blob.created:
+        process_upload.delay(blob.key)
+    return blob.key
+
+
+def release_upload(filename):
+    """Снимает ссылку на файл после удаления или замены картинки (вызывать после commit)."""
+    if filename:
+        content_store().decref(filename)
+
+
+def collect_upload_garbage(grace_period=None):
+    """Пересчитывает ссылки по базе и удаляет файлы без ссылок вместе с их копиями."""
+    counts = Counter(
+        filename
+        for (filename,) in db.session.query(Product.image).union_all(
+            db.session.query(Brand.logo)
+        )
+        if filename
+    )
+    store = content_store()
+    store.sync_refcounts(counts)
+    if grace_period is not None:
+        store.grace_period = grace_period
+    removed = store.collect_garbage()
+    for filename in removed:
+        remove_derivatives(app.config["UPLOAD_FOLDER"], filename)
+    return removed
+
+
+def invalidate_product(product):
+    """Сбрасывает кэш страниц, где виден товар (вызывать после commit)."""
+    invalidate("catalog", f"brand:{product.brand_id}", f"product:{product.id}")
+
+
+def invalidate_stock(changed):
+    """Сбрасывает кэш товаров, у которых изменился остаток: [StockChange].
+
+    Страницы каталога и брендов помнят версии показанных на них карточек,
+    поэтому достаточно версии товара. Каталог и бренд сбрасываются, только
+    если товар закончился или появился снова: меняется порядок товаров.
+    """
+    scopes = set()
+    for change in changed:
+        scopes.add(f"product:{change.product_id}")
+        if change.sold_out_changed:
+            scopes.update(("catalog", f"brand:{change.brand_id}"))
+    invalidate(*scopes)
+
+
+def invalidate_brand(brand_id, product_ids=()):
+    """Сбрасывает кэш страниц бренда и карточек его товаров (там видно имя бренда)."""
+    invalidate("catalog", f"brand:{brand_id}", *(f"product:{id}" for id in product_ids))
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(user_id)
 
 
-@app.route("/")
-def index():
-    sort_price = request.args.get("sort_price", "")
-    brand_id = request.args.get("brand", "")
-    search = request.args.get("search", "").strip()
-
-    # Базовый запрос: только активные продукты
-    products_query = Product.query.filter_by(is_active=True)
+def catalog_query(brand_id, search):
+    # Базовый запрос: только активные продукты (бренд карточки грузим сразу)
+    products_query = Product.query.options(joinedload(Product.brand)).filter_by(
+        is_active=True
+    )
 
     # Фильтр по бренду
     if brand_id:
-        products_query = products_query.filter_by(brand_id=int(brand_id))
+        products_query = products_query.filter_by(brand_id=brand_id)
 
-    # Фильтр по названию
+    # Полнотекстовый поиск по названию и описанию
+    rank = None
     if search:
-        products_query = products_query.filter(Product.title.ilike(f"%{search}%"))
+        products_query, rank = apply_search(products_query, search)
+
+    return products_query, rank
 
-    # Сортировка по цене
-    if sort_price == "asc":
-        products_query = products_query.order_by(Product.price.asc())
-    elif sort_price == "desc":
-        products_query = products_query.order_by(Product.price.desc())
 
-    products_query = products_query.order_by(
-        Product.quantity_available == 0, Product.id
+def catalog_page():
+    sort_price = request.args.get("sort_price", "")
+    # Некорректный бренд (?brand=abc) игнорируется, как и пустой
+    brand_id = request.args.get("brand", type=int)
+    search = request.args.get("search", "").strip()
+    cursor = request.args.get("after", "")
+
+    # Сортировка по цене (или по релевантности поиска),
+    # затем товары без остатка в конце, затем по id
+    products_query, rank = catalog_query(brand_id, search)
+    products, next_cursor = paginate(
+        products_query,
+        sort_price,
+        cursor,
+        per_page=app.config["CATALOG_PAGE_SIZE"],
+        rank=rank,
     )
-    products = products_query.all()
+    return products, next_cursor, brand_id, sort_price, search
+
+
+@app.route("/")
+@cached_page(lambda: ["catalog"])
+def index():
+    products, next_cursor, brand_id, sort_price, search = catalog_page()
+    prefetch_versions(f"product:{product.id}" for product in products)
     brands = Brand.query.all()
 
     return render_template(
         "index.html",
         products=products,
+        next_cursor=next_cursor,
         brands=brands,
         selected_brand=brand_id,
         sort_price=sort_price,
@@ -89,6 +283,29 @@ def index():
     )
 
 
+@app.route("/api/products")
+def api_products():
+    products, next_cursor, _, _, _ = catalog_page()
+    return jsonify(
+        products=[
+            {
+                "id": product.id,
+                "title": product.title,
+                "price": str(product.price),
+                "image": (
+                    image_url(product.image, "card") if product.image else None
+                ),
+                "brand_id": product.brand_id,
+                "brand": product.brand.name,
+                "quantity_available": product.quantity_available,
+                "url": url_for("product_page", product_id=product.id),
+            }
+            for product in products
+        ],
+        next_cursor=next_cursor,
+    )
+
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
@@ -99,8 +316,7 @@ def register():
             flash("Пользователь уже существует", "danger")
             return redirect(url_for("register"))
 
-        user = User(username=username)
-        user.set_password(password)
+        user = User(username=username, password_hash=auth.hash(password))
         db.session.add(user)
         db.session.commit()
 
@@ -117,10 +333,20 @@ def login():
         password = request.form["password"]
 
         user = User.query.filter_by(username=username).first()
-        if not user or not user.check_password(password):
+        try:
+            result = auth.login(
+                username, password, user.password_hash if user else None, request.remote_addr
+            )
+        except TooManyAttempts:
+            flash("Слишком много попыток входа, попробуйте позже", "danger")
+            return render_template("login.html"), 429
+        if not result.ok:
             flash("Неверные данные", "danger")
             return redirect(url_for("login"))
 
+        if result.new_hash:
+            user.password_hash = result.new_hash
+            db.session.commit()
         login_user(user)
         return redirect(url_for("index"))
 
@@ -130,6 +356,7 @@ def login():
 @app.route("/logout")
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for("index"))
 
@@ -143,11 +370,7 @@ def create_brand():
         description = request.form["description"]
         logo_file = request.files["logo"]
 
-        logo_filename = None
-        if logo_file:
-            ext = os.path.splitext(logo_file.filename)[1]
-            logo_filename = f"{uuid.uuid4()}{ext}"
-            logo_file.save(os.path.join(app.config["UPLOAD_FOLDER"], logo_filename))
+        logo_filename = save_upload(logo_file) if logo_file else None
 
         # Важно! Передаём owner_id вместо owner
         brand = Brand(
@@ -158,6 +381,7 @@ def create_brand():
         )
         db.session.add(brand)
         db.session.commit()
+        invalidate_brand(brand.id)
 
         flash("Бренд создан", "success")
         return redirect(url_for("brand_page", brand_id=brand.id))
@@ -178,12 +402,13 @@ def edit_brand(brand_id):
         brand.name = request.form["name"]
         brand.description = request.form["description"]
         logo_file = request.files.get("logo")
+        replaced = None
         if logo_file:
-            ext = os.path.splitext(logo_file.filename)[1]
-            logo_filename = f"{uuid.uuid4()}{ext}"
-            logo_file.save(os.path.join(app.config["UPLOAD_FOLDER"], logo_filename))
-            brand.logo = logo_filename
+            replaced = brand.logo
+            brand.logo = save_upload(logo_file)
         db.session.commit()
+        release_upload(replaced)
+        invalidate_brand(brand.id, [product.id for product in brand.products])
         flash("Бренд обновлён", "success")
         return redirect(url_for("brand_page", brand_id=brand.id))
 
@@ -199,8 +424,12 @@ def delete_brand(brand_id):
         flash("Доступ запрещён", "danger")
         return redirect(url_for("index"))
 
+    logo = brand.logo
+    product_ids = [product.id for product in brand.products]
     db.session.delete(brand)
     db.session.commit()
+    release_upload(logo)
+    invalidate_brand(brand_id, product_ids)
     flash("Бренд удалён", "success")
     return redirect(url_for("my_brands"))
 
@@ -218,15 +447,11 @@ def create_product():
     if request.method == "POST":
         title = request.form["title"]
         description = request.form["description"]
-        price = float(request.form["price"])
+        price = Decimal(request.form["price"])
         brand_id = int(request.form["brand_id"])  # выбранный бренд
         image_file = request.files["image"]
 
-        image_filename = None
-        if image_file:
-            ext = os.path.splitext(image_file.filename)[1]
-            image_filename = f"{uuid.uuid4()}{ext}"
-            image_file.save(os.path.join(app.config["UPLOAD_FOLDER"], image_filename))
+        image_filename = save_upload(image_file) if image_file else None
 
         # Находим выбранный бренд
         brand = Brand.query.get_or_404(brand_id)
@@ -240,6 +465,7 @@ def create_product():
         )
         db.session.add(product)
         db.session.commit()
+        invalidate_product(product)
         flash("Продукт создан", "success")
         return redirect(url_for("brand_page", brand_id=brand.id))
 
@@ -259,17 +485,18 @@ def edit_product(product_id):
     if request.method == "POST":
         product.title = request.form["title"]
         product.description = request.form["description"]
-        product.price = float(request.form["price"])
+        product.price = Decimal(request.form["price"])
         product.quantity_available = int(request.form["quantity_available"])
         image_file = request.files["image"]
 
+        replaced = None
         if image_file:
-            ext = os.path.splitext(image_file.filename)[1]
-            image_filename = f"{uuid.uuid4()}{ext}"
-            image_file.save(os.path.join(app.config["UPLOAD_FOLDER"], image_filename))
-            product.image = image_filename
+            replaced = product.image
+            product.image = save_upload(image_file)
 
         db.session.commit()
+        release_upload(replaced)
+        invalidate_product(product)
         flash("Продукт обновлён", "success")
         return redirect(url_for("product_page", product_id=product.id))
 
@@ -285,21 +512,35 @@ def delete_product(product_id):
         flash("Доступ запрещён", "danger")
         return redirect(url_for("index"))
 
+    image = product.image
     db.session.delete(product)
     db.session.commit()
+    release_upload(image)
+    invalidate_product(product)
     flash("Продукт удалён", "success")
     return redirect(url_for("brand_page", brand_id=product.brand.id))
 
 
 @app.route("/product/<int:product_id>")
+@cached_page(lambda product_id: [f"product:{product_id}"])
 def product_page(product_id):
-    product = Product.query.get_or_404(product_id)
+    product = (
+        Product.query.options(joinedload(Product.brand))
+        .filter_by(id=product_id)
+        .first_or_404()
+    )
     return render_template("product_page.html", product=product)
 
 
 @app.route("/brand/<int:brand_id>")
+@cached_page(lambda brand_id: [f"brand:{brand_id}"])
 def brand_page(brand_id):
-    brand = Brand.query.get_or_404(brand_id)
+    brand = (
+        Brand.query.options(selectinload(Brand.products))
+        .filter_by(id=brand_id)
+        .first_or_404()
+    )
+    prefetch_versions(f"product:{product.id}" for product in brand.products)
     return render_template("brand.html", brand=brand)
 
 
@@ -319,15 +560,23 @@ def change_user_role(user_id):
     new_role = request.form["role"]
     user.role = new_role
     db.session.commit()
+    user_cache.invalidate(user.id)
     flash("Роль изменена", "success")
     return redirect(url_for("admin_users"))
 
 
+@app.route("/admin/user-cache")
+@login_required
+@role_required("admin")
+def admin_user_cache():
+    return jsonify(user_cache.stats())
+
+
 @app.route("/admin/brands")
 @login_required
 @role_required("admin")
 def admin_brands():
-    brands = Brand.query.all()
+    brands = Brand.query.options(joinedload(Brand.owner)).all()
     return render_template("admin_brands.html", brands=brands)
 
 
@@ -342,13 +591,14 @@ def admin_edit_brand(brand_id):
         brand.description = request.form["description"]
         logo_file = request.files.get("logo")
 
+        replaced = None
         if logo_file:
-            ext = os.path.splitext(logo_file.filename)[1]
-            logo_filename = f"{uuid.uuid4()}{ext}"
-            logo_file.save(os.path.join(app.config["UPLOAD_FOLDER"], logo_filename))
-            brand.logo = logo_filename
+            replaced = brand.logo
+            brand.logo = save_upload(logo_file)
 
         db.session.commit()
+        release_upload(replaced)
+        invalidate_brand(brand.id, [product.id for product in brand.products])
         flash("Бренд обновлён", "success")
         return redirect(url_for("admin_brands"))
 
@@ -360,8 +610,12 @@ def admin_edit_brand(brand_id):
 @role_required("admin")
 def admin_delete_brand(brand_id):
     brand = Brand.query.get_or_404(brand_id)
+    logo = brand.logo
+    product_ids = [product.id for product in brand.products]
     db.session.delete(brand)
     db.session.commit()
+    release_upload(logo)
+    invalidate_brand(brand_id, product_ids)
     flash("Бренд удалён", "success")
     return redirect(url_for("admin_brands"))
 
@@ -371,8 +625,11 @@ def admin_delete_brand(brand_id):
 @role_required("admin")
 def admin_delete_product(product_id):
     product = Product.query.get_or_404(product_id)
+    image = product.image
     db.session.delete(product)
     db.session.commit()
+    release_upload(image)
+    invalidate_product(product)
     flash("Продукт удалён", "success")
     return redirect(url_for("brand_page", brand_id=product.brand_id))
 
@@ -386,16 +643,17 @@ def admin_edit_product(product_id):
     if request.method == "POST":
         product.title = request.form["title"]
         product.description = request.form["description"]
-        product.price = float(request.form["price"])
+        product.price = Decimal(request.form["price"])
         image_file = request.files.get("image")
 
+        replaced = None
         if image_file:
-            ext = os.path.splitext(image_file.filename)[1]
-            image_filename = f"{uuid.uuid4()}{ext}"
-            image_file.save(os.path.join(app.config["UPLOAD_FOLDER"], image_filename))
-            product.image = image_filename
+            replaced = product.image
+            product.image = save_upload(image_file)
 
         db.session.commit()
+        release_upload(replaced)
+        invalidate_product(product)
         flash("Продукт обновлён (админ)", "success")
         return redirect(url_for("brand_page", brand_id=product.brand.id))
 
@@ -417,31 +675,28 @@ def add_to_cart(product_id):
         flash("Только покупатели могут добавлять товары в корзину", "danger")
         return redirect(url_for("index"))
 
-    product = Product.query.get_or_404(product_id)
     quantity = int(request.form.get("quantity", 1))
-
-    if quantity < 1 or quantity > product.quantity_available:
+    if quantity < 1:
         flash("Неверное количество", "warning")
-        return redirect(url_for("product_page", product_id=product.id))
-
-    cart_item = CartItem.query.filter_by(
-        user_id=current_user.id, product_id=product.id
-    ).first()
-    if cart_item:
-
-        new_quantity = cart_item.quantity + quantity
-        if new_quantity > product.quantity_available:
-            new_quantity = product.quantity_available
-        cart_item.quantity = new_quantity
-    else:
-        cart_item = CartItem(
-            user_id=current_user.id, product_id=product.id, quantity=quantity
+        return redirect(url_for("product_page", product_id=product_id))
+
+    # Проверка остатка и запись в корзину — атомарно, в отдельной транзакции
+    with db.engine.begin() as connection:
+        change = reserve_item(
+            connection,
+            current_user.id,
+            product_id,
+            quantity,
+            ttl=app.config["CART_RESERVATION_TTL"],
         )
-        db.session.add(cart_item)
+    if change is None:
+        Product.query.get_or_404(product_id)
+        flash("Недостаточно товара на складе", "warning")
+        return redirect(url_for("product_page", product_id=product_id))
 
-    db.session.commit()
+    invalidate_stock([change])
     flash(f"Добавлено {quantity} шт. в корзину", "success")
-    return redirect(url_for("product_page", product_id=product.id))
+    return redirect(url_for("product_page", product_id=product_id))
 
 
 @app.route("/cart")
@@ -451,28 +706,280 @@ def cart_page():
         flash("Только покупатели имеют корзину", "danger")
         return redirect(url_for("index"))
 
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    total = sum(item.product.price * item.quantity for item in cart_items)
+    # Позиции, чей резерв истёк, резервируются снова, если товар ещё есть
+    with db.engine.begin() as connection:
+        changed = renew_reservations(
+            connection, current_user.id, ttl=app.config["CART_RESERVATION_TTL"]
+        )
+    invalidate_stock(changed)
+
+    cart_items, total = cart_lines(db.session, current_user.id)
     return render_template("cart.html", cart_items=cart_items, total=total)
 
 
+@app.route("/cart/summary")
+@login_required
+def cart_summary_json():
+    # Для значка корзины в шапке: агрегат без загрузки объектов
+    summary = cart_summary(db.session, current_user.id)
+    return jsonify(items=summary["items"], quantity=summary["quantity"], total=str(summary["total"]))
+
+
 @app.route("/cart/remove/<int:cart_item_id>", methods=["POST"])
 @login_required
 def remove_from_cart(cart_item_id):
-    cart_item = CartItem.query.get_or_404(cart_item_id)
-    if cart_item.user != current_user:
+    with db.engine.begin() as connection:
+        changed = remove_item(connection, current_user.id, cart_item_id)
+    if changed is None:
+        CartItem.query.get_or_404(cart_item_id)
         flash("Доступ запрещён", "danger")
         return redirect(url_for("cart_page"))
 
-    db.session.delete(cart_item)
-    db.session.commit()
+    invalidate_stock(changed)
     flash("Товар удалён из корзины", "success")
     return redirect(url_for("cart_page"))
 
 
+@app.route("/uploads/<path:filename>")
+def uploaded_file(filename):
+    # Имена загрузок уникальны: сильный ETag и immutable-кэширование
+    return send_upload(app.config["UPLOAD_FOLDER"], filename)
+
+
+@app.route("/jobs/<job_id>")
+@login_required
+def job_status(job_id):
+    status = task_queue().status(job_id)
+    if status is None:
+        abort(404)
+    return jsonify(status)
+
+
+@app.cli.command("gc-uploads")
+@click.option("--grace", type=int, default=None, help="Сколько секунд хранить файл без ссылок.")
+def gc_uploads(grace):
+    """Удалить загруженные файлы, на которые больше нет ссылок."""
+    removed = collect_upload_garbage(grace)
+    print(f"Удалено файлов: {len(removed)}")
+
+
+@app.cli.command("release-reservations")
+def release_reservations():
+    """Вернуть в остаток товар из корзин с истёкшим резервом (для cron)."""
+    with db.engine.begin() as connection:
+        changed = release_expired(connection)
+    invalidate_stock(changed)
+    print(f"Освобождено товаров: {len(changed)}")
+
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index():
+    """Перестроить полнотекстовый индекс товаров."""
+    with db.engine.begin() as connection:
+        rebuild_index(connection)
+
+
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """Применить миграции схемы к существующей базе."""
+    for name in upgrade(db.engine):
+        print(f"Применена миграция: {name}")
+
+
+_test_dir = None
+
+
+def create_test_app():
+    """Приложение на временных файлах (база, загрузки, очередь) для тестов ниже."""
+    global _test_dir
+    if _test_dir is None:
+        _test_dir = tempfile.mkdtemp(prefix="prj-test-")
+        create_app(
+            {
+                "TESTING": True,
+                "SECRET_KEY": "test",
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(_test_dir, "app.db"),
+                "UPLOAD_FOLDER": os.path.join(_test_dir, "uploads"),
+                "TASK_QUEUE_PATH": os.path.join(_test_dir, "jobs.db"),
+                "CONTENT_STORE_PATH": os.path.join(_test_dir, "blobs.db"),
+                "PAGE_CACHE": None,
+            }
+        )
+    return app
+
+
+class PrjTestCase(unittest.TestCase):
+    # Контекст приложения открывается только на время работы с базой: запросы
+    # тестового клиента должны получать свой g и свою сессию SQLAlchemy
+    def setUp(self):
+        self.app = create_test_app()
+        self.reset_db()
+
+    def reset_db(self):
+        """Пустая база и новый клиент (без cookie прежнего входа)."""
+        self.client = self.app.test_client()
+        with self.app.app_context(), db.engine.begin() as connection:
+            for table in reversed(db.metadata.sorted_tables):
+                connection.execute(table.delete())
+            rebuild_index(connection)
+        user_cache.clear()
+
+    def seed_catalog(self, brands, products, quantity=100):
+        """Бренды (у каждого свой владелец) и товары; возвращает id товаров."""
+        with self.app.app_context():
+            owners = [User(username=f"owner{i}", password_hash="-", role="brand") for i in range(brands)]
+            db.session.add_all(owners)
+            db.session.flush()
+            brands = [Brand(name=f"Бренд {i}", owner_id=owner.id) for i, owner in enumerate(owners)]
+            db.session.add_all(brands)
+            db.session.flush()
+            db.session.add_all(
+                Product(
+                    title=f"Товар {i}",
+                    description="Описание",
+                    price=Decimal("10.50"),
+                    brand_id=brands[i % len(brands)].id,
+                    quantity_available=quantity,
+                    is_active=True,
+                )
+                for i in range(products)
+            )
+            db.session.commit()
+            return [product.id for product in Product.query.order_by(Product.id)]
+
+    def login_as(self, role="buyer"):
+        with self.app.app_context():
+            user = User(username=role, password_hash="-", role=role)
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+            session["_fresh"] = True
+        return user_id
+
+    def query_count(self, url):
+        user_cache.clear()
+        # with client: контекст последнего запроса остаётся, calls() читает его g
+        with self.client:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            return calls("sql")
+
+
+class QueryBudgetTestCase(PrjTestCase):
+    def listing_counts(self, brands, products):
+        self.reset_db()
+        self.seed_catalog(brands, products)
+        counts = {url: self.query_count(url) for url in ("/", "/api/products")}
+        self.login_as("admin")
+        counts["/admin/brands"] = self.query_count("/admin/brands")
+        return counts
+
+    def test_listing_queries_do_not_grow_with_rows(self):
+        few = self.listing_counts(brands=2, products=3)
+        many = self.listing_counts(brands=40, products=200)
+        self.assertEqual(few, many)
+        for url, count in many.items():
+            self.assertLessEqual(count, self.app.config["SQL_QUERY_BUDGET"], url)
+
+    def test_product_and_brand_pages_within_budget(self):
+        product_ids = self.seed_catalog(brands=5, products=100)
+        budget = self.app.config["SQL_QUERY_BUDGET"]
+        self.assertLessEqual(self.query_count(f"/product/{product_ids[0]}"), budget)
+        with self.app.app_context():
+            brand_id = db.session.get(Product, product_ids[0]).brand_id
+        self.assertLessEqual(self.query_count(f"/brand/{brand_id}"), budget)
+
+    def test_cart_page_within_budget(self):
+        product_ids = self.seed_catalog(brands=5, products=30)
+        user_id = self.login_as("buyer")
+        with self.app.app_context(), db.engine.begin() as connection:
+            for product_id in product_ids[:20]:
+                reserve_item(connection, user_id, product_id, 2)
+        self.assertLessEqual(self.query_count("/cart"), self.app.config["SQL_QUERY_BUDGET"])
+
+    def test_over_budget_fails_in_testing(self):
+        self.seed_catalog(brands=2, products=3)
+        budget = self.app.config["SQL_QUERY_BUDGET"]
+        self.app.config["SQL_QUERY_BUDGET"] = 1
+        try:
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get("/")
+        finally:
+            self.app.config["SQL_QUERY_BUDGET"] = budget
+
+
+class CartReservationTestCase(PrjTestCase):
+    def buyers(self, count):
+        with self.app.app_context():
+            users = [User(username=f"buyer{i}", password_hash="-", role="buyer") for i in range(count)]
+            db.session.add_all(users)
+            db.session.commit()
+            return [user.id for user in users]
+
+    def reserve_concurrently(self, user_ids, product_id, quantity):
+        """Все покупатели резервируют товар одновременно; возвращает число успешных."""
+        results = []
+        start = threading.Barrier(len(user_ids))
+
+        def buy(user_id):
+            with self.app.app_context():
+                start.wait()
+                with db.engine.begin() as connection:
+                    results.append(reserve_item(connection, user_id, product_id, quantity))
+
+        threads = [threading.Thread(target=buy, args=(user_id,)) for user_id in user_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), len(user_ids))
+        return sum(result is not None for result in results)
+
+    def stock(self, product_id):
+        """(остаток на складе, зарезервировано в корзинах)."""
+        with self.app.app_context():
+            available = db.session.get(Product, product_id).quantity_available
+            reserved = db.session.query(func.coalesce(func.sum(CartItem.reserved), 0)).filter_by(
+                product_id=product_id
+            ).scalar()
+        return available, reserved
+
+    def test_last_unit_goes_to_one_buyer(self):
+        (product_id,) = self.seed_catalog(brands=1, products=1, quantity=1)
+        self.assertEqual(self.reserve_concurrently(self.buyers(2), product_id, 1), 1)
+        self.assertEqual(self.stock(product_id), (0, 1))
+
+    def test_stock_never_goes_negative(self):
+        (product_id,) = self.seed_catalog(brands=1, products=1, quantity=5)
+        succeeded = self.reserve_concurrently(self.buyers(8), product_id, 2)
+        self.assertEqual(succeeded, 2)
+        self.assertEqual(self.stock(product_id), (1, 4))
+
+    def test_expired_reservation_returns_stock(self):
+        (product_id,) = self.seed_catalog(brands=1, products=1, quantity=5)
+        (user_id,) = self.buyers(1)
+        reserved_at = datetime.utcnow() - timedelta(hours=1)
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                reserve_item(connection, user_id, product_id, 3, ttl=60, now=reserved_at)
+            self.assertEqual(self.stock(product_id), (2, 3))
+
+            with db.engine.begin() as connection:
+                changed = release_expired(connection)
+            self.assertEqual([change.product_id for change in changed], [product_id])
+            self.assertEqual(self.stock(product_id), (5, 0))
+            # Позиция остаётся в корзине, резерв восстанавливается при просмотре
+            self.assertEqual(db.session.query(CartItem.quantity).filter_by(user_id=user_id).scalar(), 3)
+            with db.engine.begin() as connection:
+                renew_reservations(connection, user_id)
+            self.assertEqual(self.stock(product_id), (2, 3))
+
+
 if __name__ == "__main__":
+    create_app()
     with app.app_context():
-        db.create_all()
         if not User.query.filter_by(username="admin").first():
             admin = User(username="admin", role="admin")
             admin.set_password("12345")  # пароль админа
@@ -0,0 +1,301 @@
+"""Кэш отрендеренных страниц и фрагментов каталога.
+
+Ключи записей включают версии областей ("catalog", "brand:<id>",
+"product:<id>"). Маршруты, меняющие товары и бренды, увеличивают версии
+затронутых областей через invalidate(), и старые записи просто перестают
+находиться (а затем вытесняются по размеру).
+
+Страница, кроме своих областей, зависит от фрагментов, отрисованных внутри
+неё (карточки товаров): запись страницы хранит версии их областей и
+считается устаревшей, если какая-то из них изменилась. Поэтому смена
+остатка одного товара сбрасывает только страницы, где он показан.
+
+Версия области — время её последнего изменения в микросекундах (строго
+растущее), поэтому по ней же страницы отдают ETag/Last-Modified и отвечают
+304 повторным анонимным посетителям. Для областей, которые ещё не менялись,
+версия — момент запуска процесса (LRUCache) или создания файла кэша
+(SQLiteCache): после перезапуска старые ETag просто перестают совпадать.
+
+Бэкенды:
+    SQLiteCache — общий файл для нескольких воркеров на одной машине;
+                  версии областей тоже общие, поэтому инвалидация видна всем.
+                  Используется по умолчанию.
+    LRUCache    — в памяти процесса, с ограничением по числу записей и байтам.
+                  Только для одного воркера: invalidate() меняет версии лишь
+                  в своём процессе, остальные продолжат отдавать старые
+                  страницы (и 304) без ограничения по времени.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, request
+from flask_login import current_user
+from markupsafe import Markup
+
+from common.conditional import can_validate, from_timestamp, make_etag, not_modified, set_validators
+
+
+def _now():
+    return time.time_ns() // 1000
+
+
+class LRUCache:
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Версии не вытесняются: иначе сброс версии вернул бы старые записи
+        self._versions = {}
+        self._started = _now()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = value
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def versions(self, scopes):
+        with self._lock:
+            return {scope: self._versions.get(scope, self._started) for scope in scopes}
+
+    def bump(self, scopes):
+        now = _now()
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = max(self._versions.get(scope, self._started) + 1, now)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class SQLiteCache:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entry (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL);
+    CREATE INDEX IF NOT EXISTS ix_entry_created ON entry (created);
+    CREATE TABLE IF NOT EXISTS version (scope TEXT PRIMARY KEY, value INTEGER NOT NULL);
+    """
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+    @contextmanager
+    def _connect(self):
+        # Одно соединение на поток: чтение из кэша не должно открывать файл заново
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.executescript(self.SCHEMA)
+            # Версия по умолчанию для областей без записи (scope = '')
+            with connection:
+                connection.execute(
+                    "INSERT OR IGNORE INTO version (scope, value) VALUES ('', ?)", (_now(),)
+                )
+            self._local.connection = connection
+        with connection:
+            yield connection
+
+    def get(self, key):
+        with self._connect() as connection:
+            row = connection.execute("SELECT value FROM entry WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entry (key, value, created) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            # Вытеснение самых старых записей — не на каждую запись
+            self._writes += 1
+            if self._writes % 100 == 0:
+                connection.execute(
+                    "DELETE FROM entry WHERE key IN ("
+                    "SELECT key FROM entry ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def versions(self, scopes):
+        scopes = list(scopes)
+        if not scopes:
+            return {}
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT scope, value FROM version WHERE scope IN ('', {', '.join('?' for _ in scopes)})",
+                scopes,
+            ).fetchall()
+        found = dict(rows)
+        return {scope: found.get(scope, found[""]) for scope in scopes}
+
+    def bump(self, scopes):
+        now = _now()
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT INTO version (scope, value) VALUES (?, ?) "
+                "ON CONFLICT (scope) DO UPDATE SET value = MAX(value + 1, excluded.value)",
+                [(scope, now) for scope in scopes],
+            )
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM entry")
+
+
+def make_backend(config):
+    if config["PAGE_CACHE"] == "sqlite":
+        return SQLiteCache(config["PAGE_CACHE_PATH"], config["PAGE_CACHE_MAX_ENTRIES"])
+    return LRUCache(config["PAGE_CACHE_MAX_ENTRIES"], config["PAGE_CACHE_MAX_BYTES"])
+
+
+def init_cache(app):
+    app.config.setdefault("PAGE_CACHE", "sqlite")  # "sqlite", "lru" или None
+    app.config.setdefault("PAGE_CACHE_PATH", "page_cache.db")
+    app.config.setdefault("PAGE_CACHE_MAX_ENTRIES", 2048)
+    app.config.setdefault("PAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+    app.extensions["page_cache"] = make_backend(app.config) if app.config["PAGE_CACHE"] else None
+    app.jinja_env.globals["cached_fragment"] = cached_fragment
+
+
+def _backend():
+    return current_app.extensions.get("page_cache")
+
+
+def versions(scopes):
+    """Версии областей; в пределах запроса запоминаются в g."""
+    known = g.setdefault("cache_versions", {})
+    missing = [scope for scope in scopes if scope not in known]
+    if missing:
+        known.update(_backend().versions(missing))
+    return [known[scope] for scope in scopes]
+
+
+def prefetch_versions(scopes):
+    """Загрузить версии для нескольких областей одним обращением к бэкенду."""
+    if _backend() is not None:
+        versions(list(scopes))
+
+
+def invalidate(*scopes):
+    backend = _backend()
+    if backend is not None and scopes:
+        backend.bump(scopes)
+        g.pop("cache_versions", None)
+
+
+def _key(name, scopes):
+    return name + "|" + ",".join(f"{scope}={version}" for scope, version in zip(scopes, versions(scopes)))
+
+
+def cached_fragment(name, scopes, render, *args):
+    """Фрагмент из кэша или результат render(*args) с сохранением в кэш.
+
+    В шаблоне render — обычно макрос:
+        {{ cached_fragment("card:%d" % p.id, ["product:%d" % p.id], card, p) }}
+    """
+    backend = _backend()
+    if backend is None:
+        return render(*args)
+    key = _key("fragment:" + name, scopes)
+    # Страница, внутри которой рисуется фрагмент, зависит и от его версий
+    dependencies = g.get("cache_dependencies")
+    if dependencies is not None:
+        dependencies.update(scopes)
+    html = backend.get(key)
+    if html is None:
+        html = str(render(*args))
+        backend.set(key, html)
+    return Markup(html)
+
+
+def _load_page(value):
+    """Запись страницы: (версии областей фрагментов, html) или None."""
+    try:
+        entry = json.loads(value)
+        return entry["dependencies"], entry["html"]
+    except (TypeError, ValueError, KeyError):
+        return None
+
+
+def _page_validators(key, page_scopes, dependencies):
+    etag = make_etag(key, *(f"{scope}={version}" for scope, version in sorted(dependencies.items())))
+    last_modified = from_timestamp(max(versions(page_scopes) + list(dependencies.values())))
+    return etag, last_modified
+
+
+def cached_page(scopes):
+    """Кэширует страницу целиком для анонимных GET-запросов.
+
+    scopes(**view_args) возвращает области, от которых зависит страница;
+    области фрагментов, отрисованных внутри неё, запоминаются сами.
+    Попадание в кэш не выполняет ни одного SQL-запроса к базе приложения.
+    Ответ несёт ETag и Last-Modified по версиям всех этих областей;
+    совпавший условный запрос получает 304 без рендера.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            backend = _backend()
+            if backend is None or not can_validate() or current_user.is_authenticated:
+                return f(*args, **kwargs)
+
+            page_scopes = scopes(**kwargs)
+            key = _key("page:" + request.full_path, page_scopes)
+            entry = _load_page(backend.get(key))
+            if entry is not None:
+                dependencies, html = entry
+                if versions(list(dependencies)) == list(dependencies.values()):
+                    etag, last_modified = _page_validators(key, page_scopes, dependencies)
+                    response = not_modified(etag, last_modified)
+                    if response is not None:
+                        return response
+                    response = current_app.response_class(html, mimetype="text/html")
+                    response.headers["X-Cache"] = "HIT"
+                    return set_validators(response, etag, last_modified)
+
+            g.cache_dependencies = set()
+            try:
+                rv = f(*args, **kwargs)
+            finally:
+                dependency_scopes = sorted(g.pop("cache_dependencies"))
+            if not isinstance(rv, str):
+                return rv
+            dependencies = dict(zip(dependency_scopes, versions(dependency_scopes)))
+            backend.set(key, json.dumps({"dependencies": dependencies, "html": rv}))
+            etag, last_modified = _page_validators(key, page_scopes, dependencies)
+            # Запись могла быть вытеснена, а у клиента та же версия страницы
+            response = not_modified(etag, last_modified)
+            if response is not None:
+                return response
+            return set_validators(current_app.response_class(rv, mimetype="text/html"), etag, last_modified)
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,228 @@
+"""Корзина с резервированием остатков.
+
+Добавление в корзину резервирует товар: остаток уменьшается условным
+UPDATE (только если его хватает), а позиция корзины создаётся или
+увеличивается через INSERT ... ON CONFLICT по уникальному индексу
+(user_id, product_id). Проверка и запись выполняются одним оператором под
+блокировкой записи SQLite, поэтому параллельные запросы не могут продать
+больше, чем есть на складе.
+
+Резерв живёт до reserved_until. release_expired() снимает просроченные
+резервы и возвращает товар в остаток, а сами позиции остаются в корзине
+с reserved = 0 и reserved_until = NULL (так же выглядят позиции, созданные
+до появления резервов). Такие позиции остаток не держат; renew_reservations()
+резервирует их снова при просмотре корзины, если товар ещё есть.
+
+Функции, меняющие остаток, возвращают StockChange по каждому товару:
+sold_out_changed — товар закончился или снова появился, от этого зависит
+порядок товаров в каталоге.
+
+Функции принимают соединение (db.engine.begin()): транзакция, которая
+начинается сразу с записи, ждёт блокировку по busy_timeout, а не падает
+с "database is locked" при переходе от чтения к записи.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import delete, func, select, type_coerce, update
+from sqlalchemy.dialects.sqlite import insert
+
+from models import CartItem, Money, Product
+
+cart_item = CartItem.__table__
+product = Product.__table__
+
+RESERVATION_TTL = 30 * 60
+
+StockChange = namedtuple("StockChange", "product_id brand_id sold_out_changed")
+
+# Цены в копейках: произведение и сумма в SQL точные, в Decimal переводит Money
+line_total = type_coerce(product.c.price * cart_item.c.quantity, Money)
+
+
+def reserve_item(connection, user_id, product_id, quantity, ttl=RESERVATION_TTL, now=None):
+    """Резервирует quantity единиц товара в корзину пользователя.
+
+    Возвращает StockChange или None, если товар не найден, неактивен
+    или его не хватает (тогда сначала освобождаются просроченные резервы).
+    """
+    now = now or datetime.utcnow()
+    change = _take_stock(connection, product_id, quantity)
+    released = None
+    if change is None:
+        released = release_expired(connection, now, product_id)
+        if released:
+            change = _take_stock(connection, product_id, quantity)
+    if change is None:
+        return None
+    if released:
+        # Освобождение и новый резерв вместе: "закончился" меняется, только
+        # если поменялся ровно одним из двух шагов
+        change = change._replace(sold_out_changed=change.sold_out_changed != released[0].sold_out_changed)
+
+    statement = insert(cart_item).values(
+        user_id=user_id,
+        product_id=product_id,
+        quantity=quantity,
+        reserved=quantity,
+        reserved_until=now + timedelta(seconds=ttl),
+    )
+    connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=[cart_item.c.user_id, cart_item.c.product_id],
+            set_={
+                "quantity": cart_item.c.quantity + statement.excluded.quantity,
+                "reserved": cart_item.c.reserved + statement.excluded.reserved,
+                "reserved_until": statement.excluded.reserved_until,
+            },
+        )
+    )
+    return change
+
+
+def _take_stock(connection, product_id, quantity):
+    row = connection.execute(
+        update(product)
+        .where(
+            product.c.id == product_id,
+            product.c.is_active.is_(True),
+            product.c.quantity_available >= quantity,
+        )
+        .values(quantity_available=product.c.quantity_available - quantity)
+        .returning(product.c.brand_id, product.c.quantity_available)
+    ).first()
+    if row is None:
+        return None
+    return StockChange(product_id, row.brand_id, row.quantity_available == 0)
+
+
+def _return_stock(connection, amounts):
+    """Возвращает товар в остаток: {product_id: количество}. Возвращает [StockChange]."""
+    changed = []
+    for product_id, amount in amounts.items():
+        row = connection.execute(
+            update(product)
+            .where(product.c.id == product_id)
+            .values(quantity_available=product.c.quantity_available + amount)
+            .returning(product.c.brand_id, product.c.quantity_available)
+        ).first()
+        if row is not None:
+            changed.append(StockChange(product_id, row.brand_id, row.quantity_available == amount))
+    return changed
+
+
+def remove_item(connection, user_id, cart_item_id):
+    """Удаляет позицию пользователя и снимает её резерв.
+
+    Возвращает [StockChange] товаров, чей остаток изменился, или None,
+    если такой позиции у пользователя нет.
+    """
+    row = connection.execute(
+        delete(cart_item)
+        .where(cart_item.c.id == cart_item_id, cart_item.c.user_id == user_id)
+        .returning(cart_item.c.product_id, cart_item.c.reserved)
+    ).first()
+    if row is None:
+        return None
+    return _return_stock(connection, {row.product_id: row.reserved}) if row.reserved else []
+
+
+def release_expired(connection, now=None, product_id=None):
+    """Снимает истёкшие резервы и возвращает товар в остаток; позиции остаются в корзине.
+
+    Возвращает [StockChange] товаров, чей остаток изменился.
+    """
+    condition = cart_item.c.reserved_until < (now or datetime.utcnow())
+    if product_id is not None:
+        condition &= cart_item.c.product_id == product_id
+    expired = dict(connection.execute(select(cart_item.c.id, cart_item.c.reserved).where(condition)).all())
+    if not expired:
+        return []
+    # Условие проверяется ещё раз под блокировкой записи: резерв, который успели
+    # снять или продлить параллельно, второй раз в остаток не вернётся
+    rows = connection.execute(
+        update(cart_item)
+        .where(condition, cart_item.c.id.in_(expired))
+        .values(reserved=0, reserved_until=None)
+        .returning(cart_item.c.id, cart_item.c.product_id)
+    ).all()
+
+    amounts = {}
+    for cart_item_id, expired_product_id in rows:
+        amounts[expired_product_id] = amounts.get(expired_product_id, 0) + expired[cart_item_id]
+    return _return_stock(connection, {key: value for key, value in amounts.items() if value})
+
+
+def renew_reservations(connection, user_id, ttl=RESERVATION_TTL, now=None):
+    """Резервирует заново позиции пользователя, не держащие остаток (reserved < quantity).
+
+    Позиция, для которой товара уже не хватает, остаётся без резерва.
+    Возвращает [StockChange] товаров, чей остаток изменился.
+    """
+    now = now or datetime.utcnow()
+    rows = connection.execute(
+        select(cart_item.c.id, cart_item.c.product_id, cart_item.c.quantity, cart_item.c.reserved).where(
+            cart_item.c.user_id == user_id, cart_item.c.reserved < cart_item.c.quantity
+        )
+    ).all()
+    changed = []
+    for row in rows:
+        missing = row.quantity - row.reserved
+        change = _take_stock(connection, row.product_id, missing)
+        if change is None:
+            continue
+        renewed = connection.execute(
+            update(cart_item)
+            .where(
+                cart_item.c.id == row.id,
+                cart_item.c.quantity == row.quantity,
+                cart_item.c.reserved == row.reserved,
+            )
+            .values(reserved=row.quantity, reserved_until=now + timedelta(seconds=ttl))
+            .returning(cart_item.c.id)
+        ).first()
+        if renewed is None:
+            # Позицию успели изменить или удалить — товар возвращаем
+            _return_stock(connection, {row.product_id: missing})
+            continue
+        changed.append(change)
+    return changed
+
+
+def cart_lines(connection, user_id):
+    """Позиции корзины с суммами по строкам и итогом — одним запросом.
+
+    Возвращает (строки, итог); строки — Row с полями id, product_id, title,
+    price, quantity, reserved, line_total.
+    """
+    rows = connection.execute(
+        select(
+            cart_item.c.id,
+            cart_item.c.product_id,
+            product.c.title,
+            product.c.price,
+            cart_item.c.quantity,
+            cart_item.c.reserved,
+            line_total.label("line_total"),
+            type_coerce(func.sum(product.c.price * cart_item.c.quantity).over(), Money).label("total"),
+        )
+        .select_from(cart_item.join(product, product.c.id == cart_item.c.product_id))
+        .where(cart_item.c.user_id == user_id)
+        .order_by(cart_item.c.id)
+    ).all()
+    return rows, rows[0].total if rows else Decimal("0.00")
+
+
+def cart_summary(connection, user_id):
+    """Число позиций, единиц товара и сумма корзины без загрузки объектов."""
+    row = connection.execute(
+        select(
+            func.count(cart_item.c.id),
+            func.coalesce(func.sum(cart_item.c.quantity), 0),
+            type_coerce(func.coalesce(func.sum(product.c.price * cart_item.c.quantity), 0), Money),
+        )
+        .select_from(cart_item.join(product, product.c.id == cart_item.c.product_id))
+        .where(cart_item.c.user_id == user_id)
+    ).one()
+    return {"items": row[0], "quantity": row[1], "total": row[2]}
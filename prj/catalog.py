@@ -0,0 +1,104 @@
+import base64
+import binascii
+import json
+
+from sqlalchemy import and_, or_
+
+from models import Product, product_sold_out
+
+
+def sort_columns(sort_price, rank=None):
+    """Колонки сортировки каталога в порядке применения: (выражение, по убыванию).
+
+    sort_price == "rank" сортирует по релевантности поиска (выражение rank).
+    """
+    columns = []
+    if sort_price == "rank":
+        columns.append((rank, False))
+    elif sort_price == "asc":
+        columns.append((Product.price, False))
+    elif sort_price == "desc":
+        columns.append((Product.price, True))
+    columns.append((product_sold_out, False))
+    columns.append((Product.id, False))
+    return columns
+
+
+def sort_values(product, sort_price, rank_value=None):
+    values = []
+    if sort_price == "rank":
+        values.append(rank_value)
+    elif sort_price in ("asc", "desc"):
+        # Decimal в JSON — строкой; при сравнении её переводит в копейки тип Money
+        values.append(str(product.price))
+    values.append(1 if product.quantity_available == 0 else 0)
+    values.append(product.id)
+    return values
+
+
+def encode_cursor(product, sort_price, rank_value=None):
+    payload = json.dumps(
+        [sort_price, sort_values(product, sort_price, rank_value)], separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort_price):
+    """Возвращает значения ключа из курсора или None, если курсор битый
+    или выдан для другой сортировки."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, values = json.loads(raw)
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if cursor_sort != sort_price or not isinstance(values, list):
+        return None
+    if len(values) != len(sort_columns(sort_price)):
+        return None
+    return values
+
+
+def after_condition(sort_price, values, rank=None):
+    """Условие "строго после курсора" для составного ключа со смешанными направлениями."""
+    columns = sort_columns(sort_price, rank)
+    branches = []
+    for i, (column, descending) in enumerate(columns):
+        equal = [columns[j][0] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        branches.append(and_(*equal, step))
+    return or_(*branches)
+
+
+def paginate(query, sort_price, cursor=None, per_page=20, rank=None):
+    """Keyset-пагинация запроса товаров.
+
+    Возвращает (товары страницы, курсор следующей страницы или None).
+    Стоимость страницы не зависит от её номера: вместо OFFSET используется
+    условие по ключу сортировки последнего показанного товара.
+    Если передано выражение rank, а сортировка по цене не выбрана,
+    товары упорядочиваются по релевантности.
+    """
+    if rank is not None and sort_price not in ("asc", "desc"):
+        sort_price = "rank"
+        query = query.add_columns(rank)
+    else:
+        rank = None
+
+    values = decode_cursor(cursor, sort_price)
+    if values is not None:
+        query = query.filter(after_condition(sort_price, values, rank))
+
+    order_by = [column.desc() if descending else column.asc()
+                for column, descending in sort_columns(sort_price, rank)]
+    rows = query.order_by(*order_by).limit(per_page + 1).all()
+    if rank is None:
+        rows = [(product, None) for product in rows]
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        product, rank_value = rows[-1]
+        next_cursor = encode_cursor(product, sort_price, rank_value)
+    return [product for product, _ in rows], next_cursor
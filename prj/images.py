@@ -0,0 +1,113 @@
+import logging
+import os
+import tempfile
+
+from flask import abort, current_app, redirect, url_for
+from werkzeug.utils import safe_join
+
+from common.fileserve import send_upload
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен — отдаём оригиналы
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Размеры производных изображений: (ширина, высота, обрезать под размер)
+SIZES = {
+    "card": (480, 360, True),  # карточка каталога высотой 180px, 2x для HiDPI
+    "logo": (400, 200, False),  # логотип бренда высотой до 100px
+    "page": (1000, 1000, False),  # страница товара
+}
+DERIVED_DIR = "derived"
+DERIVED_FORMAT = "webp"
+DERIVED_QUALITY = 80
+
+
+def derived_name(filename):
+    return os.path.splitext(filename)[0] + "." + DERIVED_FORMAT
+
+
+def derived_path(upload_folder, size, filename):
+    return os.path.join(upload_folder, DERIVED_DIR, size, derived_name(filename))
+
+
+def make_derivative(upload_folder, size, filename):
+    """Создаёт уменьшенную копию изображения. Возвращает путь или None."""
+    if Image is None or size not in SIZES:
+        return None
+    source = safe_join(upload_folder, filename)
+    if source is None or not os.path.isfile(source):
+        return None
+
+    target = derived_path(upload_folder, size, filename)
+    if os.path.exists(target):
+        return target
+
+    width, height, crop = SIZES[size]
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "RGBA"):
+                has_alpha = "A" in image.getbands() or "transparency" in image.info
+                image = image.convert("RGBA" if has_alpha else "RGB")
+            if crop and image.width > width and image.height > height:
+                image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+            else:
+                image.thumbnail((width, height), Image.LANCZOS)
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Пишем во временный файл и атомарно переименовываем,
+            # чтобы параллельный запрос не отдал недописанный файл
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+            with os.fdopen(fd, "wb") as tmp:
+                image.save(tmp, DERIVED_FORMAT, quality=DERIVED_QUALITY, method=4)
+            os.replace(tmp_path, target)
+    except (OSError, ValueError):
+        logger.exception("Не удалось создать %s для %s", size, filename)
+        return None
+    return target
+
+
+def make_derivatives(upload_folder, filename):
+    for size in SIZES:
+        make_derivative(upload_folder, size, filename)
+
+
+def remove_derivatives(upload_folder, filename):
+    for size in SIZES:
+        try:
+            os.remove(derived_path(upload_folder, size, filename))
+        except FileNotFoundError:
+            pass
+
+
+def image_url(filename, size):
+    """URL изображения нужного размера для шаблонов.
+
+    Готовая производная отдаётся как обычная загрузка, иначе — через
+    маршрут, который создаст её при первом запросе.
+    """
+    upload_folder = current_app.config["UPLOAD_FOLDER"]
+    if os.path.exists(derived_path(upload_folder, size, filename)):
+        relative = "/".join((DERIVED_DIR, size, derived_name(filename)))
+        return url_for("uploaded_file", filename=relative)
+    return url_for("image_derivative", size=size, filename=filename)
+
+
+def serve_derivative(size, filename):
+    if size not in SIZES:
+        abort(404)
+    upload_folder = current_app.config["UPLOAD_FOLDER"]
+    target = make_derivative(upload_folder, size, filename)
+    if target is None:
+        # Нет Pillow или файл не картинка — отдаём оригинал
+        return redirect(url_for("uploaded_file", filename=filename))
+    # Путь относительно UPLOAD_FOLDER: из него X-Accel-Redirect строит адрес для nginx
+    return send_upload(upload_folder, os.path.relpath(target, upload_folder))
+
+
+def init_images(app):
+    app.add_url_rule("/media/<size>/<path:filename>", "image_derivative", serve_derivative)
+    app.jinja_env.globals["image_url"] = image_url
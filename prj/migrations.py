@@ -0,0 +1,109 @@
+"""Миграции схемы для уже существующей базы app.db.
+
+Номер применённой миграции хранится в PRAGMA user_version. Каждая миграция
+идемпотентна, поэтому её можно выполнить и на базе, созданной через
+db.create_all() с уже актуальной схемой.
+"""
+from search import index_exists, rebuild_index
+
+MIGRATIONS = []
+
+
+def migration(f):
+    MIGRATIONS.append(f)
+    return f
+
+
+@migration
+def add_hot_column_indexes(connection):
+    # Перед уникальным индексом сливаем дубли позиций корзины в одну строку
+    connection.exec_driver_sql(
+        "UPDATE cart_item SET quantity = ("
+        "  SELECT SUM(other.quantity) FROM cart_item AS other"
+        "  WHERE other.user_id = cart_item.user_id"
+        "  AND other.product_id = cart_item.product_id"
+        ") WHERE id IN ("
+        "  SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id HAVING COUNT(*) > 1"
+        ")"
+    )
+    connection.exec_driver_sql(
+        "DELETE FROM cart_item WHERE id NOT IN ("
+        "  SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id"
+        ")"
+    )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_item_user_product "
+        "ON cart_item (user_id, product_id)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_brand_owner_id ON brand (owner_id)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_product_active_sold_out ON product ("
+        "is_active, CASE WHEN (quantity_available = 0) THEN 1 ELSE 0 END, id)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_product_active_price ON product ("
+        "is_active, price, CASE WHEN (quantity_available = 0) THEN 1 ELSE 0 END, id)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_product_brand_active_price "
+        "ON product (brand_id, is_active, price)"
+    )
+    connection.exec_driver_sql("ANALYZE")
+
+
+@migration
+def add_cart_reservations(connection):
+    columns = {row[1] for row in connection.exec_driver_sql("PRAGMA table_info(cart_item)")}
+    if "reserved" not in columns:
+        connection.exec_driver_sql(
+            "ALTER TABLE cart_item ADD COLUMN reserved INTEGER NOT NULL DEFAULT 0"
+        )
+    if "reserved_until" not in columns:
+        connection.exec_driver_sql("ALTER TABLE cart_item ADD COLUMN reserved_until DATETIME")
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_cart_item_reserved_until ON cart_item (reserved_until)"
+    )
+
+
+@migration
+def store_prices_in_kopecks(connection):
+    # Product.price стал Money (целые копейки); база, созданная заново, уже в копейках
+    columns = {row[1]: row[2].upper() for row in connection.exec_driver_sql("PRAGMA table_info(product)")}
+    if columns.get("price") != "INTEGER":
+        connection.exec_driver_sql(
+            "UPDATE product SET price = CAST(ROUND(price * 100) AS INTEGER)"
+        )
+
+
+@migration
+def add_product_search_index(connection):
+    # product_fts раньше создавался только в db.create_all(); базы, обновлённые
+    # миграциями, остались без него
+    if not index_exists(connection):
+        rebuild_index(connection)
+
+
+def current_version(connection):
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def upgrade(engine, metadata=None):
+    """Создаёт недостающие таблицы metadata и применяет ещё не выполненные миграции.
+
+    Возвращает список имён применённых миграций.
+    """
+    applied = []
+    with engine.begin() as connection:
+        # Блокировка записи с первого оператора: воркеры, стартующие
+        # одновременно, создают схему и мигрируют по очереди, а не дважды
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        if metadata is not None:
+            metadata.create_all(connection)
+        version = current_version(connection)
+        for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            step(connection)
+            connection.exec_driver_sql(f"PRAGMA user_version = {number}")
+            applied.append(step.__name__)
+    return applied
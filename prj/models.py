@@ -1,9 +1,35 @@
+from decimal import ROUND_HALF_UP, Decimal
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Integer, case, literal_column
+from sqlalchemy.types import TypeDecorator
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+
+class Money(TypeDecorator):
+    """Деньги как Decimal с двумя знаками; в базе — целое число копеек.
+
+    Суммы в SQL (SUM(price * quantity)) считаются в целых числах и точны.
+    """
+    impl = Integer
+    cache_ok = True
+    CENT = Decimal("0.01")
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int((Decimal(str(value)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        # Старые столбцы с типом FLOAT возвращают копейки как 1250.0
+        return (Decimal(int(round(value))) / 100).quantize(self.CENT)
+
+
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
@@ -24,7 +50,7 @@ class Brand(db.Model):
     name = db.Column(db.String(150), nullable=False)
     description = db.Column(db.Text)
     logo = db.Column(db.String(255))
-    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
 
     products = db.relationship('Product', backref='brand', lazy=True)
 
@@ -32,17 +58,37 @@ class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text)
-    price = db.Column(db.Float, nullable=False)
+    price = db.Column(Money, nullable=False)
     image = db.Column(db.String(255))
     is_active = db.Column(db.Boolean, default=True)
     brand_id = db.Column(db.Integer, db.ForeignKey('brand.id'), nullable=False)
     quantity_available = db.Column(db.Integer, default=10)
 
+# Признак "нет в наличии": каталог сортирует такие товары в конец.
+# Литералы вместо параметров, чтобы выражение совпадало с индексами ниже.
+product_sold_out = case(
+    (Product.quantity_available == literal_column("0"), literal_column("1")),
+    else_=literal_column("0"),
+)
+
+# Индексы под запросы каталога: активные товары по умолчанию и с сортировкой
+# по цене, фильтр по бренду
+db.Index("ix_product_active_sold_out", Product.is_active, product_sold_out, Product.id)
+db.Index("ix_product_active_price", Product.is_active, Product.price, product_sold_out, Product.id)
+db.Index("ix_product_brand_active_price", Product.brand_id, Product.is_active, Product.price)
+
 class CartItem(db.Model):
+    __table_args__ = (
+        db.Index("uq_cart_item_user_product", "user_id", "product_id", unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, default=1)
+    # Сколько единиц товара держит позиция и до какого момента (см. cart.py)
+    reserved = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    reserved_until = db.Column(db.DateTime, index=True)
 
     user = db.relationship('User', backref='cart_items')
     product = db.relationship('Product')
\ No newline at end of file
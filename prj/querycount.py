@@ -0,0 +1,32 @@
+import logging
+
+from flask import current_app, request
+
+from common.metrics import calls
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def init_query_counter(app):
+    """Проверяет лимит SQL-запросов за запрос SQL_QUERY_BUDGET.
+
+    Запросы считает init_metrics(app, sql=True) — у движка один слушатель
+    на оба счётчика. В режиме TESTING превышение лимита бросает QueryBudgetExceeded,
+    иначе пишет предупреждение в лог.
+    """
+    app.config.setdefault("SQL_QUERY_BUDGET", 10)
+
+    @app.after_request
+    def check_query_budget(response):
+        count = calls("sql")
+        budget = current_app.config["SQL_QUERY_BUDGET"]
+        if budget is not None and count > budget:
+            message = f"{request.endpoint}: {count} SQL-запросов при лимите {budget}"
+            if current_app.testing:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,93 @@
+import re
+
+from sqlalchemy import column, event, func, literal_column, or_, table
+
+from models import db, Product
+
+FTS_TABLE = "product_fts"
+
+# Заголовок весит больше описания при ранжировании
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+product_fts = table(FTS_TABLE, column("rowid"), column("title"), column("description"))
+
+
+def _fts_enabled(bind):
+    return bind.dialect.name == "sqlite"
+
+
+def index_exists(connection):
+    return connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)
+    ).first() is not None
+
+
+def create_table(connection):
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "title, description, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+
+
+def rebuild_index(connection):
+    """Полностью перестраивает поисковый индекс по таблице product (создаёт его, если нет)."""
+    create_table(connection)
+    connection.exec_driver_sql(f"DELETE FROM {FTS_TABLE}")
+    connection.exec_driver_sql(
+        f"INSERT INTO {FTS_TABLE} (rowid, title, description) "
+        "SELECT id, title, coalesce(description, '') FROM product"
+    )
+
+
+@event.listens_for(db.metadata, "after_create")
+def create_index(target, connection, **kw):
+    if not _fts_enabled(connection):
+        return
+    if not index_exists(connection):
+        rebuild_index(connection)
+
+
+# Индекс обновляется в той же транзакции, что и сам товар
+@event.listens_for(Product, "after_insert")
+@event.listens_for(Product, "after_update")
+def index_product(mapper, connection, product):
+    if not _fts_enabled(connection):
+        return
+    connection.exec_driver_sql(f"DELETE FROM {FTS_TABLE} WHERE rowid = ?", (product.id,))
+    connection.exec_driver_sql(
+        f"INSERT INTO {FTS_TABLE} (rowid, title, description) VALUES (?, ?, ?)",
+        (product.id, product.title, product.description or ""),
+    )
+
+
+@event.listens_for(Product, "after_delete")
+def unindex_product(mapper, connection, product):
+    if not _fts_enabled(connection):
+        return
+    connection.exec_driver_sql(f"DELETE FROM {FTS_TABLE} WHERE rowid = ?", (product.id,))
+
+
+def match_expression(search):
+    """Превращает пользовательский ввод в FTS5-запрос: все слова, по префиксу."""
+    terms = re.findall(r"\w+", search)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def apply_search(query, search):
+    """Добавляет к запросу товаров полнотекстовый фильтр.
+
+    Возвращает (запрос, выражение релевантности или None). Меньшее значение
+    релевантности означает лучшее совпадение (bm25 в SQLite).
+    """
+    match = match_expression(search)
+    if not match or not _fts_enabled(db.engine):
+        pattern = f"%{search}%"
+        return query.filter(or_(Product.title.ilike(pattern), Product.description.ilike(pattern))), None
+
+    rank = func.bm25(literal_column(FTS_TABLE), TITLE_WEIGHT, DESCRIPTION_WEIGHT)
+    query = query.join(product_fts, product_fts.c.rowid == Product.id).filter(
+        literal_column(FTS_TABLE).op("MATCH")(match)
+    )
+    return query, rank
@@ -0,0 +1,44 @@
+import sqlite3
+
+from sqlalchemy import event
+
+# Применяются к каждому новому соединению с SQLite
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",  # читатели не блокируют писателя и наоборот
+    "synchronous": "NORMAL",  # в режиме WAL безопасно и без fsync на каждый коммит
+    "cache_size": -20000,  # ~20 МБ страничного кэша на соединение
+    "mmap_size": 268435456,  # 256 МБ файла базы читаются через mmap
+    "busy_timeout": 5000,  # ждать блокировку до 5 с вместо "database is locked"
+    "temp_store": "MEMORY",
+}
+
+
+def engine_options(pool_size=10, max_overflow=20, timeout=30):
+    """Параметры движка для многопоточных воркеров (SQLALCHEMY_ENGINE_OPTIONS)."""
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": timeout,
+        "connect_args": {"timeout": timeout, "check_same_thread": False},
+    }
+
+
+def apply_pragmas(dbapi_connection, pragmas=None):
+    cursor = dbapi_connection.cursor()
+    for name, value in (pragmas or DEFAULT_PRAGMAS).items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def init_sqlite(app, db):
+    """Включает настройки SQLITE_PRAGMAS на каждом новом соединении движка приложения."""
+    app.config.setdefault("SQLITE_PRAGMAS", DEFAULT_PRAGMAS)
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            apply_pragmas(dbapi_connection, app.config["SQLITE_PRAGMAS"])